@@ -11,16 +11,171 @@ Default: March, days 1, 10, 20 across 2018-2024
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
 from datetime import datetime
 from pathlib import Path
-import cv2
 import tempfile
 import os
-from goes_climate_viz import download_and_average_goes_images
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from collections import deque
+from itertools import islice
+from goes_climate_viz import load_goes_image, cache_goes_images, create_video_from_frames
 
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 
-def create_hourly_frames(month, days, hours, satellite, domain, coarsening_factor, cache_dir, verbose=True, temporal_resolution="hourly"):
+try:
+    import joblib
+except ImportError:
+    joblib = None
+
+# Images read ahead on threads while the running means are updated
+PREFETCH_IMAGES = 8
+
+# Month names, indexed by month - 1
+MONTH_NAMES = [datetime(2000, month, 1).strftime('%B') for month in range(1, 13)]
+
+
+if njit is not None:
+    # Serial: it runs in the shard workers, one per core already, so numba
+    # threads on top would only oversubscribe the cores. Cached to disk, as
+    # each worker would otherwise compile it afresh.
+    @njit(nogil=True, fastmath=True, cache=True)
+    def _running_mean_kernel(mean, data, scale, count):
+        """Fold flat data * scale into flat mean as sample number count, in one pass."""
+        inv_count = 1.0 / count
+        for p in range(mean.shape[0]):
+            mean[p] += (data[p] * scale - mean[p]) * inv_count
+
+
+def _update_running_mean(mean, data, count):
+    """
+    Fold an image into a running mean in place, in a single compiled pass
+    when numba is available. 8-bit images (from the uint8 cache) are scaled to [0, 1] on
+    the fly.
+    """
+    scale = 1.0 / 255.0 if data.dtype == np.uint8 else 1.0
+    if njit is None:
+        mean += (data * scale - mean) / count
+    else:
+        _running_mean_kernel(mean.reshape(-1), np.ascontiguousarray(data).reshape(-1), scale, count)
+
+
+def accumulate_hourly_means(all_dates, time_intervals, satellite, domain, coarsening_factor, cache_dir, verbose=False, download=True):
+    """
+    Average images for several times of day in a single pass over the dates.
+    
+    Uses an incremental running mean, so only one buffer per interval is
+    needed and no final division.
+    
+    Args:
+        all_dates: List of datetime objects to include
+        time_intervals: List of (hour, minute) tuples to accumulate
+        satellite: "east" or "west"
+        domain: Domain (F=Full Disk, C=CONUS, etc.)
+        coarsening_factor: Factor to coarsen images
+        cache_dir: Directory for cached images
+        verbose: Whether to print progress
+        download: Whether to download images missing from the cache
+        
+    Returns:
+        Tuple of (means, counts): float32 array of shape (n_intervals, H, W, 3)
+        and int array of image counts per interval. means is None if no image
+        could be loaded.
+    """
+    means = None
+    counts = np.zeros(len(time_intervals), dtype=np.int64)
+    
+    jobs = iter([
+        (idx, date.replace(hour=hour, minute=minute, second=0, microsecond=0))
+        for date in all_dates
+        for idx, (hour, minute) in enumerate(time_intervals)
+    ])
+    
+    def load(target_time):
+        return load_goes_image(
+            target_time,
+            satellite=satellite,
+            coarsening_factor=coarsening_factor,
+            domain=domain,
+            use_cache=True,
+            cache_dir=cache_dir,
+            verbose=verbose,
+            dequantize=False,  # Scaled inside the running mean update
+            download=download
+        )
+    
+    # Read the next few images in full on threads (file reads release the
+    # GIL, so several are in flight at once) while this thread folds each one
+    # into its mean in order. The window bounds how many are held in memory.
+    with ThreadPoolExecutor(max_workers=PREFETCH_IMAGES) as pool:
+        pending = deque(
+            (idx, pool.submit(load, target_time))
+            for idx, target_time in islice(jobs, PREFETCH_IMAGES)
+        )
+        while pending:
+            idx, future = pending.popleft()
+            for next_idx, next_time in islice(jobs, 1):
+                pending.append((next_idx, pool.submit(load, next_time)))
+            
+            data = future.result()
+            if data is None:
+                continue
+            
+            # float32 halves the memory traffic of the accumulator
+            if means is None:
+                means = np.zeros((len(time_intervals),) + data.shape, dtype=np.float32)
+            counts[idx] += 1
+            _update_running_mean(means[idx], data, counts[idx])
+    
+    return means, counts
+
+
+def _probe_frame_shape(all_dates, time_intervals, satellite, domain, coarsening_factor, cache_dir, download=True):
+    """Return the shape of the first image that loads, or None if none do."""
+    for date in all_dates:
+        for hour, minute in time_intervals:
+            target_time = date.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            data = load_goes_image(
+                target_time,
+                satellite=satellite,
+                coarsening_factor=coarsening_factor,
+                domain=domain,
+                use_cache=True,
+                cache_dir=cache_dir,
+                verbose=False,
+                download=download
+            )
+            if data is not None:
+                return data.shape
+    return None
+
+
+def _is_memoized(accumulate, kwargs):
+    """Whether joblib already holds the result of accumulate(**kwargs)."""
+    return accumulate.check_call_in_cache(**kwargs)
+
+
+def _accumulate_shard(accumulate, buffer_path, buffer_shape, shard, **kwargs):
+    """
+    Average one shard of time intervals and write the means into the shared
+    frame buffer at the shard's slots.
+    
+    Returns:
+        Array of image counts per interval in the shard
+    """
+    shard_means, shard_counts = accumulate(**kwargs)
+    if shard_means is not None:
+        frame_buffer = np.memmap(buffer_path, dtype=np.float16, mode='r+', shape=buffer_shape)
+        frame_buffer[shard] = shard_means
+        frame_buffer.flush()
+        del frame_buffer
+    return shard_counts
+
+
+def create_hourly_frames(month, days, hours, satellite, domain, coarsening_factor, cache_dir, verbose=True, temporal_resolution="hourly", cache_results=True):
     """
     Create hourly/sub-hourly progression frames showing average day cycle.
     
@@ -34,19 +189,17 @@ def create_hourly_frames(month, days, hours, satellite, domain, coarsening_facto
         cache_dir: Directory for cached images
         verbose: Whether to print progress
         temporal_resolution: "hourly" for 1-hour intervals, "30min" for 30-minute intervals
+        cache_results: Whether to memoize accumulated means on disk with joblib (if installed)
         
     Returns:
         List of averaged image arrays for each time interval
     """
-    frames = []
-    
     # Create all dates for the specified month and days across all years
-    all_dates = []
-    for year in range(2018, 2025):  # 7 years: 2018-2024
-        for day in days:
-            all_dates.append(datetime(year, month, day))
+    years = np.arange(2018, 2025)  # 7 years: 2018-2024
+    day_grid, year_grid = np.meshgrid(days, years)
+    all_dates = [datetime(int(year), month, int(day)) for year, day in zip(year_grid.ravel(), day_grid.ravel())]
     
-    month_name = datetime(2000, month, 1).strftime('%B')
+    month_name = MONTH_NAMES[month - 1]
     
     # Determine minutes based on temporal resolution
     if temporal_resolution == "30min":
@@ -68,103 +221,125 @@ def create_hourly_frames(month, days, hours, satellite, domain, coarsening_facto
         for minute in minutes:
             time_intervals.append((hour, minute))
     
-    # Create frames for each time interval
-    for i, (hour, minute) in enumerate(time_intervals):
-        if verbose:
-            time_str = f"{hour:02d}:{minute:02d}Z"
-            print(f"\nCreating frame {i+1}/{total_frames} for {time_str} ({len(all_dates)} dates)")
-        
-        try:
-            # Use existing function to average all dates for this time
-            averaged_image = download_and_average_goes_images(
-                hours=[hour],
-                dates=all_dates,
-                satellite=satellite,
-                coarsening_factor=coarsening_factor,
-                domain=domain,
-                output_path='/Volumes/Thomas/GOES Imagery',  # Temporary output
-                save_format="png",
-                use_cache=True,
-                cache_dir=cache_dir,
-                verbose=True,  # Suppress detailed output
-                minutes=[minute]
-            )
-            frames.append(averaged_image)
-            
-        except Exception as e:
-            time_str = f"{hour:02d}:{minute:02d}Z"
-            print(f"Error creating frame for {time_str}: {e}")
-            continue
+    # Each worker makes a single pass over the dates for its share of the
+    # time intervals, so every cached image is opened exactly once
+    n_workers = max(1, min(len(time_intervals), os.cpu_count() or 1))
+    shards = [list(range(len(time_intervals)))[w::n_workers] for w in range(n_workers)]
     
-    return frames
-
-
-def create_video_from_frames(frames, output_path, filename, fps=None, verbose=True):
-    """
-    Create MP4 video from list of frames.
-    
-    Args:
-        frames: List of RGB image arrays
-        output_path: Directory to save video
-        filename: Output filename
-        fps: Frames per second (calculated for 6s duration if None)
-        verbose: Whether to print progress
-    """
-    if not frames:
-        print("No frames to create video")
-        return
-    
-    # Calculate FPS for 6-second duration
-    if fps is None:
-        fps = len(frames) / 6.5     ########### EXACTLY 6 BREAKS VIDEO FOR UNKNOWN REASON ###########
-    
-    # Create output directory relative to current working directory
-    output_path = os.path.join(os.getcwd(), output_path)
-    os.makedirs(output_path, exist_ok=True)
+    # Memoize the accumulated means so reruns (e.g. with a different fps or
+    # filename) skip loading and averaging entirely
+    accumulate = accumulate_hourly_means
+    if cache_results and joblib is not None:
+        memory = joblib.Memory(Path(cache_dir) / "joblib", verbose=0)
+        accumulate = memory.cache(accumulate_hourly_means, ignore=["verbose", "download"])
     
-    # Convert frames to video format
-    video_frames = []
-    for i, frame in enumerate(frames):
-        if verbose:
-            print(f"Processing frame {i+1}/{len(frames)} for video")
-        
-        # Convert to 8-bit RGB
-        frame_8bit = (frame * 255).astype(np.uint8)
-        
-        # Convert RGB to BGR for OpenCV
-        frame_bgr = cv2.cvtColor(frame_8bit, cv2.COLOR_RGB2BGR)
-        video_frames.append(frame_bgr)
+    shard_kwargs = [
+        dict(
+            all_dates=all_dates,
+            time_intervals=[time_intervals[idx] for idx in shard],
+            satellite=satellite,
+            coarsening_factor=coarsening_factor,
+            domain=domain,
+            cache_dir=cache_dir,
+            verbose=False,  # Workers print over each other
+            download=False  # The cache is filled from this process below
+        )
+        for shard in shards
+    ]
     
-    # Write video
-    if video_frames:
-        h, w = video_frames[0].shape[:2]
-        filepath = os.path.join(output_path, filename)
-        
-        # Create video writer
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(filepath, fourcc, fps, (w, h), isColor=True)
+    counts = [0] * len(time_intervals)
+    # Workers come from a forkserver rather than being forked: this process
+    # runs the download pool's threads, and forking a process with threads
+    # running can deadlock the child
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=mp.get_context("forkserver")) as executor:
+        # Download everything the shards will read through this process's
+        # pool before fanning out, so the whole run stays within
+        # DOWNLOAD_PROCESSES. Memoized shards read nothing, so their images
+        # are skipped. The lookup runs in a worker because joblib keys a
+        # script's functions by module name, which is __mp_main__ there.
+        memoized = [False] * len(shards)
+        if accumulate is not accumulate_hourly_means:
+            memoized = list(executor.map(_is_memoized, [accumulate] * len(shards), shard_kwargs))
+        times = [
+            date.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            for kwargs, done in zip(shard_kwargs, memoized) if not done
+            for date in all_dates
+            for hour, minute in kwargs["time_intervals"]
+        ]
+        failed = set(cache_goes_images(
+            times,
+            satellite=satellite,
+            coarsening_factor=coarsening_factor,
+            domain=domain,
+            cache_dir=cache_dir,
+            verbose=verbose
+        ))
         
-        for frame in video_frames:
-            # print(np.count_nonzero(np.isnan(frame)), "NaNs in frame")
-            # print('Max value in frame:', np.nanmax(frame))
-            # print('Mean value in frame:', np.nanmean(frame))
-            # print('Mean of first bit:', np.mean(frame[0:10,0:10,:]))
-            out.write(frame)
+        # Probe one image for the frame shape so the shared buffer can be
+        # sized, downloading one only if nothing is cached
+        probe_args = (all_dates, time_intervals, satellite, domain, coarsening_factor, cache_dir)
+        frame_shape = _probe_frame_shape(*probe_args, download=False)
+        if frame_shape is None:
+            frame_shape = _probe_frame_shape(*probe_args)
+        if frame_shape is None:
+            print("Error creating frames: no images were successfully downloaded")
+            return []
         
-        out.release()
+        # Workers write their means straight into a shared float16 memmap
+        # (float16 is ample for 8-bit video output), so no frame is pickled
+        # back to this process or held twice. Each worker owns disjoint
+        # slots, so no locking.
+        buffer_shape = (len(time_intervals),) + frame_shape
+        fd, buffer_path = tempfile.mkstemp(suffix=".frames")
+        os.close(fd)
+        frame_buffer = np.memmap(buffer_path, dtype=np.float16, mode='w+', shape=buffer_shape)
         
-        if verbose:
-            print(f"✓ Video saved: {filepath}")
-            print(f"✓ Duration: {len(frames)/fps:.1f} seconds")
-            print(f"✓ FPS: {fps:.1f}")
-            print(f"✓ Total frames: {len(frames)}")
-
+        try:
+            futures = {}
+            for shard, kwargs in zip(shards, shard_kwargs):
+                # Don't memoize a mean that is missing images whose download
+                # failed this time: the memo key can't tell, so a rerun would
+                # never add them back
+                shard_accumulate = accumulate
+                if failed and any(
+                    date.replace(hour=hour, minute=minute, second=0, microsecond=0) in failed
+                    for date in all_dates
+                    for hour, minute in kwargs["time_intervals"]
+                ):
+                    shard_accumulate = accumulate_hourly_means
+                future = executor.submit(_accumulate_shard, shard_accumulate, buffer_path, buffer_shape, shard, **kwargs)
+                futures[future] = shard
+            
+            for future in as_completed(futures):
+                shard = futures[future]
+                try:
+                    shard_counts = future.result()
+                except Exception as e:
+                    print(f"Error creating frames for {len(shard)} time intervals: {e}")
+                    continue
+                for j, idx in enumerate(shard):
+                    counts[idx] = int(shard_counts[j])
+                if verbose:
+                    print(f"Accumulated {len(shard)} time intervals ({len(all_dates)} dates each)")
+        finally:
+            # The mapping stays valid after the file is unlinked
+            os.remove(buffer_path)
+    
+    # Preserve the requested frame order, skipping intervals with no images
+    frames = []
+    for idx, (hour, minute) in enumerate(time_intervals):
+        if counts[idx] == 0:
+            print(f"Error creating frame for {hour:02d}:{minute:02d}Z: no images were successfully downloaded")
+            continue
+        frames.append(frame_buffer[idx])
+    
+    return frames
 
 
-def main(month=3, days=[1, 3,5,7,9,11,13,15,17,19,21,23,25,27], temporal_resolution="30min"):
+def main(month=3, days=[1, 3,5,7,9,11,13,15,17,19,21,23,25,27], temporal_resolution="30min", cache_results=True):
     """Generate average day progression video."""
     
-    month_name = datetime(2000, month, 1).strftime('%B')
+    month_name = MONTH_NAMES[month - 1]
     
     print("=" * 70)
     print("GOES Average Day Video Generator")
@@ -196,7 +371,8 @@ def main(month=3, days=[1, 3,5,7,9,11,13,15,17,19,21,23,25,27], temporal_resolut
             coarsening_factor=2,
             cache_dir="/Volumes/Thomas/GOES Imagery",
             verbose=True,
-            temporal_resolution=temporal_resolution
+            temporal_resolution=temporal_resolution,
+            cache_results=cache_results
         )
         # plt.imshow(frames[1])
         # plt.show()
@@ -242,6 +418,8 @@ if __name__ == "__main__":
                        help='Days to include (default: 1, 3,5,7,9,11,13,15,17,19,21,23,25,27)')
     parser.add_argument('--temporal-resolution', choices=['hourly', '30min'], default='30min',
                        help='Temporal resolution: hourly (24 frames) or 30min (48 frames)')
+    parser.add_argument('--no-cache-results', action='store_true',
+                       help='Recompute the hourly means instead of reusing ones memoized by earlier runs')
     args = parser.parse_args()
     
     # Validate month
@@ -254,5 +432,10 @@ if __name__ == "__main__":
         print("Error: Days must be between 1 and 31")
         sys.exit(1)
     
-    success = main(month=args.month, days=args.days, temporal_resolution=args.temporal_resolution)
+    success = main(
+        month=args.month,
+        days=args.days,
+        temporal_resolution=args.temporal_resolution,
+        cache_results=not args.no_cache_results
+    )
     sys.exit(0 if success else 1)
\ No newline at end of file
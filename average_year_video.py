@@ -12,16 +12,85 @@ Total video duration: 6 seconds
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
-from datetime import datetime
 from pathlib import Path
-import cv2
-import tempfile
 import os
-from goes_climate_viz import download_and_average_goes_images
+import hashlib
+import multiprocessing as mp
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from goes_climate_viz import sum_goes_images, cache_goes_images, frame_to_uint8, create_video_from_frames, save_as_png, write_gif_from_frames
+from convert_mp4_to_gif import DEFAULT_SCALE, digest_path
 
 
-def create_seasonal_frames(n_days, hours, satellite, domain, coarsening_factor, cache_dir, verbose=True):
+def _position_cache_path(*, hours, dates, satellite, domain, coarsening_factor, cache_dir):
+    """Cache file for one position's sum, keyed by a hash of everything that goes into it."""
+    key = hashlib.sha1(repr(sorted(dates) + list(hours) + [satellite, domain, coarsening_factor]).encode()).hexdigest()
+    return Path(cache_dir) / f"position_sum_{key}.npz"
+
+
+def sum_position(*, hours, dates, satellite, domain, coarsening_factor, cache_dir, cache_results=True, download=True):
+    """
+    Sum the images for one date position, reusing a cached result when the
+    same dates have been summed before.
+    
+    The cache file is keyed by a hash of the sorted dates, hours, satellite,
+    domain and coarsening factor. The position mean is stored as float16
+    (ample for 8-bit output) together with the image count, and the sum is
+    rebuilt from the two on load.
+    
+    Args:
+        hours: List of hours to process
+        dates: List of datetime objects for this position
+        satellite: "east" or "west"
+        domain: Domain (F=Full Disk, C=CONUS, etc.)
+        coarsening_factor: Factor to coarsen images
+        cache_dir: Directory for cached images
+        cache_results: Whether to read and write the position cache
+        download: Whether to download images missing from the image cache
+        
+    Returns:
+        Tuple of (summed image as float32 or None, number of images summed)
+    """
+    cache_path = _position_cache_path(
+        hours=hours,
+        dates=dates,
+        satellite=satellite,
+        domain=domain,
+        coarsening_factor=coarsening_factor,
+        cache_dir=cache_dir
+    )
+    
+    if cache_results and cache_path.exists():
+        try:
+            with np.load(cache_path) as cached:
+                count = int(cached["count"])
+                return cached["mean"].astype(np.float32) * count, count
+        except Exception as e:
+            print(f"Error reading cached position sum {cache_path}: {e}")
+    
+    pos_sum, pos_count = sum_goes_images(
+        hours=hours,
+        dates=dates,
+        satellite=satellite,
+        coarsening_factor=coarsening_factor,
+        domain=domain,
+        use_cache=True,
+        cache_dir=cache_dir,
+        verbose=False,  # Workers print over each other
+        dtype=np.float32,
+        download=download
+    )
+    
+    if cache_results and pos_count:
+        try:
+            np.savez(cache_path, mean=(pos_sum / pos_count).astype(np.float16), count=pos_count)
+        except Exception as e:
+            print(f"Error caching position sum {cache_path}: {e}")
+    
+    return pos_sum, pos_count
+
+
+def create_seasonal_frames(n_days, hours, satellite, domain, coarsening_factor, cache_dir, verbose=True, cache_results=True):
     """
     Create seasonal progression frames with moving averages of N days.
     
@@ -33,52 +102,32 @@ def create_seasonal_frames(n_days, hours, satellite, domain, coarsening_factor,
         coarsening_factor: Factor to coarsen images
         cache_dir: Directory for cached images
         verbose: Whether to print progress
+        cache_results: Whether to cache per-position sums on disk between runs
         
     Returns:
         List of averaged image arrays for each frame
     """
     frames = []
     
-    # Create all dates for all years using all odd days per month
-    all_dates_by_position = []
-    
-    # Function to get all odd days for a given month/year
-    def get_odd_days_for_month(year, month):
-        from calendar import monthrange
-        _, days_in_month = monthrange(year, month)
-        return [day for day in range(1, days_in_month + 1) if day % 2 == 1]
-    
-    for year in range(2018, 2025):  # 7 years: 2018-2024
-        for month in range(1, 13):  # 12 months
-            odd_days = get_odd_days_for_month(year, month)
-            for day in odd_days:
-                all_dates_by_position.append(datetime(year, month, day))
+    # Create all dates for all years using all odd days per month, as
+    # datetime64 so the grouping below stays vectorized
+    all_days = np.arange('2018-01-01', '2025-01-01', dtype='datetime64[D]')  # 7 years: 2018-2024
+    months = all_days.astype('datetime64[M]')
+    day_of_month = (all_days - months).astype(int) + 1
+    month_of_year = months.astype(int) % 12 + 1
+    odd = day_of_month % 2 == 1
     
     # Organize dates by position in year (variable positions based on odd days)
-    # Each position contains dates from all 7 years
-    dates_by_year_position = {}
-    
-    # Create position mapping: track cumulative position across months
-    position_counter = 0
-    month_day_to_position = {}
-    
-    # Use a reference year (2020) to establish position mapping
-    for month in range(1, 13):
-        odd_days = get_odd_days_for_month(2020, month)  # Use 2020 as reference
-        for day in odd_days:
-            month_day_to_position[(month, day)] = position_counter
-            position_counter += 1
-    
-    # Now assign positions to all dates
-    for date in all_dates_by_position:
-        position = month_day_to_position[(date.month, date.day)]
-        if position not in dates_by_year_position:
-            dates_by_year_position[position] = []
-        dates_by_year_position[position].append(date)
-    
-    # Sort positions and create sliding window
-    positions = sorted(dates_by_year_position.keys())
-    n_positions = len(positions)
+    # Each position contains dates from all 7 years. Dates are grouped by a
+    # packed month*100 + day key, which sorts in calendar order, and stay
+    # datetime64 until each group is converted (datetime64[s] becomes
+    # datetime.datetime at the API boundary).
+    keys = month_of_year[odd] * 100 + day_of_month[odd]
+    order = np.argsort(keys, kind='stable')
+    boundaries = np.flatnonzero(np.diff(keys[order])) + 1
+    sorted_dates = all_days[odd][order].astype('datetime64[s]')
+    dates_by_year_position = [group.tolist() for group in np.split(sorted_dates, boundaries)]
+    n_positions = len(dates_by_year_position)
     
     # Calculate stride to get approximately 36-40 frames
     stride = max(1, n_positions // 40)  # Aim for ~40 frames
@@ -88,115 +137,166 @@ def create_seasonal_frames(n_days, hours, satellite, domain, coarsening_factor,
         print(f"Moving average window: {n_days} consecutive date positions")
         print(f"Frame stride: {stride} (every {stride} positions)")
         print(f"Expected frames: {(n_positions + stride - 1) // stride}")
-        print(f"Each position contains dates from {len(dates_by_year_position[positions[0]])} years")
+        print(f"Each position contains dates from {len(dates_by_year_position[0])} years")
     
-    # Create frames using sliding window of N consecutive positions
-    for start_pos in range(0, n_positions, stride):
-        # Get N consecutive positions (wrapping around at end of year)
-        window_positions = []
-        for i in range(n_days):
-            pos_idx = (start_pos + i) % n_positions
-            window_positions.append(positions[pos_idx])
-        
-        # Collect all dates from these positions across all years
-        frame_dates = []
-        for pos in window_positions:
-            frame_dates.extend(dates_by_year_position[pos])
-        
-        if verbose:
-            first_date = sorted(frame_dates)[0]
-            last_date = sorted(frame_dates)[-1]
-            frame_num = (start_pos // stride) + 1
-            total_frames = (n_positions + stride - 1) // stride
-            print(f"\nFrame {frame_num}/{total_frames}: {len(frame_dates)} dates")
-            print(f"  Date range: {first_date.strftime('%m/%d')} to {last_date.strftime('%m/%d')} (all years)")
-            print(f"  Positions: {window_positions}")
-        
-        # Use existing function to average all dates for this frame
-        try:
-            averaged_image = download_and_average_goes_images(
-                hours=hours,
-                dates=frame_dates,
-                satellite=satellite,
-                coarsening_factor=coarsening_factor,
-                domain=domain,
-                output_path="average_year_output/Frames", 
-                save_format="png",
-                use_cache=True,
-                cache_dir=cache_dir,
-                verbose=True
-            )
-            # Rename noon output file
-            noon_output = Path("average_year_output/Frames") / "goes_east_climate_avg.png"
-            noon_final = Path("average_year_output/Frames") / f"average_year_frame_{frame_dates[0].month}-{frame_dates[0].day}_to_{frame_dates[-1].month}-{frame_dates[-1].day}_n_dates={len(frame_dates)}.png"
-            noon_output.rename(noon_final)
-        
-            frames.append(averaged_image)
-            
-        except Exception as e:
-            print(f"Error creating frame {start_pos + 1}: {e}")
-            continue
-    
-    return frames
-
-
-def create_video_from_frames(frames, output_path, filename, fps=None, verbose=True):
-    """
-    Create MP4 video from list of frames.
-    
-    Args:
-        frames: List of RGB image arrays
-        output_path: Directory to save video
-        filename: Output filename
-        fps: Frames per second (calculated for 10s duration if None)
-        verbose: Whether to print progress
-    """
-    if not frames:
-        print("No frames to create video")
-        return
+    # Get N consecutive positions per frame (wrapping around at end of year)
+    starts = np.arange(0, n_positions, stride)
+    windows = ((starts[:, None] + np.arange(n_days)) % n_positions).tolist()
     
-    # Calculate FPS for 6-second duration
-    if fps is None:
-        fps = len(frames) / 6.0
+    # Adjacent windows overlap, so each position is summed once (in parallel)
+    # and frames keep a running window sum: add entering positions, subtract
+    # leaving ones. Only the current window's position sums are held in memory.
+    entering_by_frame = []
+    previous = set()
+    for window_positions in windows:
+        entering_by_frame.append([pos for pos in window_positions if pos not in previous])
+        previous = set(window_positions)
+    schedule = [pos for entering in entering_by_frame for pos in entering]
     
-    # Create output directory
-    Path(output_path).mkdir(parents=True, exist_ok=True)
+    max_workers = os.cpu_count() or 1
+    position_sums = {}
+    running_sum = None
+    running_count = 0
+    averaged_image = None  # Reused for every frame's average
+    previous_window = []
     
-    # Convert frames to video format
-    video_frames = []
-    for i, frame in enumerate(frames):
-        if verbose:
-            print(f"Processing frame {i+1}/{len(frames)} for video")
-        
-        # Convert to 8-bit RGB
-        frame_8bit = (frame * 255).astype(np.uint8)
-        
-        # Convert RGB to BGR for OpenCV
-        frame_bgr = cv2.cvtColor(frame_8bit, cv2.COLOR_RGB2BGR)
-        video_frames.append(frame_bgr)
+    # Download every image the uncached positions need through this process's
+    # pool before fanning out, so the whole run stays within
+    # DOWNLOAD_PROCESSES; the workers then only read the image cache
+    times = [
+        date.replace(hour=hour)
+        for pos in dict.fromkeys(schedule)  # Positions re-enter at the year wrap
+        if not (cache_results and _position_cache_path(
+            hours=hours,
+            dates=dates_by_year_position[pos],
+            satellite=satellite,
+            domain=domain,
+            coarsening_factor=coarsening_factor,
+            cache_dir=cache_dir
+        ).exists())
+        for date in dates_by_year_position[pos]
+        for hour in hours
+    ]
+    failed = set(cache_goes_images(
+        times,
+        satellite=satellite,
+        coarsening_factor=coarsening_factor,
+        domain=domain,
+        cache_dir=cache_dir,
+        verbose=verbose
+    ))
     
-    # Write video
-    if video_frames:
-        h, w = video_frames[0].shape[:2]
-        filepath = str(Path(output_path) / filename)
-        
-        # Create video writer
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(filepath, fourcc, fps, (w, h), isColor=True)
+    # Workers come from a forkserver rather than being forked: this process
+    # now runs the download pool's threads, and forking a process with
+    # threads running can deadlock the child
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp.get_context("forkserver")) as executor:
+        # Keep a bounded number of positions in flight, consumed in schedule order
+        in_flight = deque()
+        next_to_submit = 0
+        png_futures = {}
         
-        for frame in video_frames:
-            out.write(frame)
+        def top_up():
+            nonlocal next_to_submit
+            while next_to_submit < len(schedule) and len(in_flight) < 2 * max_workers:
+                pos = schedule[next_to_submit]
+                # Don't cache a sum missing images whose download failed this
+                # time: the cache key can't tell, and a cached position is
+                # never downloaded again
+                complete = not any(
+                    date.replace(hour=hour) in failed
+                    for date in dates_by_year_position[pos]
+                    for hour in hours
+                )
+                future = executor.submit(
+                    sum_position,
+                    hours=hours,
+                    dates=dates_by_year_position[pos],
+                    satellite=satellite,
+                    domain=domain,
+                    coarsening_factor=coarsening_factor,
+                    cache_dir=cache_dir,
+                    cache_results=cache_results and complete,
+                    download=False
+                )
+                in_flight.append((pos, future))
+                next_to_submit += 1
         
-        out.release()
+        for frame_idx, window_positions in enumerate(windows):
+            # Collect all dates from these positions across all years
+            frame_dates = []
+            for pos in window_positions:
+                frame_dates.extend(dates_by_year_position[pos])
+            
+            if verbose:
+                first_date = min(frame_dates)
+                last_date = max(frame_dates)
+                print(f"\nFrame {frame_idx + 1}/{len(windows)}: {len(frame_dates)} dates")
+                print(f"  Date range: {first_date.strftime('%m/%d')} to {last_date.strftime('%m/%d')} (all years)")
+                print(f"  Positions: {window_positions}")
+            
+            # Drop positions that left the window
+            for pos in previous_window:
+                if pos in window_positions:
+                    continue
+                pos_sum, pos_count = position_sums.pop(pos)
+                if pos_count:
+                    running_sum -= pos_sum
+                    running_count -= pos_count
+            
+            # Add positions that entered the window
+            for pos in entering_by_frame[frame_idx]:
+                top_up()
+                _, future = in_flight.popleft()
+                try:
+                    pos_sum, pos_count = future.result()
+                except Exception as e:
+                    print(f"Error summing position {pos}: {e}")
+                    pos_sum, pos_count = None, 0
+                position_sums[pos] = (pos_sum, pos_count)
+                if pos_count:
+                    if running_sum is None:
+                        running_sum = np.zeros_like(pos_sum)
+                    running_sum += pos_sum
+                    running_count += pos_count
+            previous_window = window_positions
+            
+            if running_count == 0:
+                print(f"Error creating frame {frame_idx + 1}: No images were successfully downloaded")
+                continue
+            
+            if averaged_image is None:
+                averaged_image = np.empty_like(running_sum)
+            np.multiply(running_sum, 1.0 / running_count, out=averaged_image)
+            frames_dir = Path("average_year_output/Frames")
+            frames_dir.mkdir(parents=True, exist_ok=True)
+            
+            # Quantize once here; 8-bit is all the video and the PNG need
+            frame = frame_to_uint8(averaged_image)
+            frames.append(frame)
+            
+            # Encode the frame PNG in the pool too; nothing downstream waits
+            # on it
+            png_name = f"average_year_frame_{frame_dates[0].month}-{frame_dates[0].day}_to_{frame_dates[-1].month}-{frame_dates[-1].day}_n_dates={len(frame_dates)}.png"
+            png_futures[png_name] = executor.submit(
+                save_as_png,
+                frame,
+                frames_dir,
+                png_name,
+                verbose=False  # Workers print over each other
+            )
         
-        if verbose:
-            print(f"✓ Video saved: {filepath}")
-            print(f"✓ Duration: {len(frames)/fps:.1f} seconds")
-            print(f"✓ FPS: {fps:.1f}")
-            print(f"✓ Total frames: {len(frames)}")
+        for png_name, future in png_futures.items():
+            try:
+                future.result()
+                if verbose:
+                    print(f"Saved PNG: {png_name}")
+            except Exception as e:
+                print(f"Error saving {png_name}: {e}")
+    
+    return frames
 
 
-def main(n_days=6):
+def main(n_days=6, cache_results=True):
     """Generate average year seasonal progression video."""
     
     print("=" * 70)
@@ -221,21 +321,41 @@ def main(n_days=6):
             domain="F",
             coarsening_factor=2,
             cache_dir="/Volumes/Thomas/GOES Imagery",
-            verbose=True
+            verbose=True,
+            cache_results=cache_results
         )
         
         # Create video
+        mp4_path = Path(f"average_year_output/goes_east_average_year_n{n_days}_odddays.mp4")
         create_video_from_frames(
             frames=frames,
-            output_path="average_year_output",
-            filename=f"goes_east_average_year_n{n_days}_odddays.mp4",
+            output_path=mp4_path.parent,
+            filename=mp4_path.name,
             fps=None,  # Auto-calculate for 6s duration
             verbose=True
         )
         
+        # Write a GIF straight from the frames rather than re-decoding the MP4,
+        # named as convert_mp4_to_gif.py would name its GIF
+        if frames:
+            gif_path = mp4_path.with_name(f"{mp4_path.stem}_{DEFAULT_SCALE}px.gif")
+            write_gif_from_frames(
+                frames,
+                gif_path,
+                fps=len(frames) / 6.0,
+                scale=DEFAULT_SCALE,
+                verbose=True
+            )
+            # This GIF keeps the video's frame rate and has its own palette,
+            # unlike the converter's (resampled to its fps, shared palette), so
+            # record that it came from frames rather than the converter's
+            # digest. The converter then replaces it with its own encode
+            # instead of trusting the mtime or a sidecar from an earlier run.
+            digest_path(gif_path).write_text("frames")
+        
         print("=" * 70)
         print("✓ Average year video completed successfully!")
-        print(f"✓ Output: average_year_output/goes_east_average_year_n{n_days}_odddays.mp4")
+        print(f"✓ Output: {mp4_path}")
         print("=" * 70)
         
         return True
@@ -253,7 +373,9 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Generate GOES average year video')
     parser.add_argument('--n-days', type=int, default=15, 
                        help='Number of consecutive days to average (default: 6)')
+    parser.add_argument('--no-cache-results', action='store_true',
+                       help='Recompute the per-position sums instead of reusing cached ones')
     args = parser.parse_args()
     
-    success = main(n_days=args.n_days)
+    success = main(n_days=args.n_days, cache_results=not args.no_cache_results)
     sys.exit(0 if success else 1)
\ No newline at end of file
@@ -7,12 +7,25 @@ Uses ffmpeg for high-quality conversion with optimized settings.
 """
 
 import os
+import hashlib
 import subprocess
+import tempfile
 from pathlib import Path
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+# Optional fast hash for the up-to-date check; falls back to SHA-1
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
 
-def convert_mp4_to_gif(mp4_path, gif_path, fps=10, scale=512, verbose=True):
+# Settings main() converts with unless given others
+DEFAULT_FPS = 10
+DEFAULT_SCALE = 512
+
+
+def convert_mp4_to_gif(mp4_path, gif_path, fps=10, scale=512, verbose=True, palette_path=None):
     """
     Convert MP4 to GIF using ffmpeg with optimization.
     
@@ -22,28 +35,47 @@ def convert_mp4_to_gif(mp4_path, gif_path, fps=10, scale=512, verbose=True):
         fps: Frames per second for GIF (default 10)
         scale: Width to scale GIF to (height auto-calculated, default 512)
         verbose: Whether to print progress
+        palette_path: Existing palette PNG to use; if None, one is generated
+            for this file
     """
     if verbose:
         print(f"Converting {mp4_path.name} to {gif_path.name}...")
     
-    # ffmpeg command for high-quality GIF conversion
-    # Uses palettegen/paletteuse for better colors and compression
-    cmd = [
-        'ffmpeg', '-y',  # -y to overwrite existing files
-        '-i', str(mp4_path),
-        '-filter_complex', 
-        f'[0:v] fps={fps},scale={scale}:-1:flags=lanczos,split [a][b];[a] palettegen [p];[b][p] paletteuse',
-        str(gif_path)
-    ]
+    # Two-pass ffmpeg conversion for high-quality GIFs: first build a palette
+    # (stats_mode=diff weights the pixels that change), then map the video
+    # onto it. mpdecimate drops duplicate frames and diff_mode=rectangle only
+    # re-encodes the changed region of each frame. The first pass is skipped
+    # when a shared palette is given.
+    filters = f'fps={fps},scale={scale}:-1:flags=lanczos'
     
     try:
-        # Run ffmpeg with suppressed output unless there's an error
-        result = subprocess.run(
-            cmd, 
-            capture_output=True, 
-            text=True, 
-            check=True
-        )
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            commands = []
+            if palette_path is None:
+                palette_path = Path(tmp_dir) / 'palette.png'
+                commands.append([
+                    'ffmpeg', '-y', '-threads', '0',  # -y to overwrite existing files
+                    '-i', str(mp4_path),
+                    '-vf', f'{filters},palettegen=stats_mode=diff',
+                    str(palette_path)
+                ])
+            commands.append([
+                'ffmpeg', '-y', '-threads', '0',
+                '-i', str(mp4_path),
+                '-i', str(palette_path),
+                '-filter_complex',
+                f'[0:v]{filters},mpdecimate[x];[x][1:v]paletteuse=dither=bayer:bayer_scale=5:diff_mode=rectangle',
+                str(gif_path)
+            ])
+            
+            # Run ffmpeg with suppressed output unless there's an error
+            for cmd in commands:
+                subprocess.run(
+                    cmd, 
+                    capture_output=True, 
+                    text=True, 
+                    check=True
+                )
         
         if verbose:
             print(f"✓ Successfully converted: {gif_path}")
@@ -60,6 +92,90 @@ def convert_mp4_to_gif(mp4_path, gif_path, fps=10, scale=512, verbose=True):
     return True
 
 
+def make_shared_palette(mp4_paths, palette_path, verbose=True):
+    """
+    Generate one GIF palette from a sample of frames across several MP4s.
+    
+    The climatology videos share a similar color distribution, so a single
+    palette can be reused for every conversion, leaving only the paletteuse
+    pass per file. Frames are sampled at 1 fps and scaled to a common size
+    so the videos can be concatenated; the palette only sees color statistics,
+    so the aspect ratio doesn't matter.
+    
+    Args:
+        mp4_paths: List of MP4 file paths to sample
+        palette_path: Path to write the palette PNG to
+        verbose: Whether to print progress
+        
+    Returns:
+        True if the palette was written, False otherwise
+    """
+    if verbose:
+        print(f"Generating shared palette from {len(mp4_paths)} MP4 file(s)...")
+    
+    cmd = ['ffmpeg', '-y', '-threads', '0']
+    for mp4_path in mp4_paths:
+        cmd += ['-i', str(mp4_path)]
+    
+    scaled = ''.join(f'[{i}:v]fps=1,scale=256:256,setsar=1[v{i}];' for i in range(len(mp4_paths)))
+    inputs = ''.join(f'[v{i}]' for i in range(len(mp4_paths)))
+    cmd += [
+        '-filter_complex',
+        f'{scaled}{inputs}concat=n={len(mp4_paths)}:v=1:a=0,palettegen=stats_mode=diff',
+        str(palette_path)
+    ]
+    
+    try:
+        subprocess.run(cmd, capture_output=True, text=True, check=True)
+    except subprocess.CalledProcessError as e:
+        print(f"❌ Error generating palette: {e.stderr}")
+        return False
+    except FileNotFoundError:
+        print("❌ ffmpeg not found. Please install ffmpeg:")
+        print("  macOS: brew install ffmpeg")
+        print("  Linux: sudo apt install ffmpeg")
+        return False
+    
+    if verbose:
+        print(f"✓ Palette saved: {palette_path}")
+    
+    return True
+
+
+def source_digest(mp4_path, fps, scale):
+    """
+    Hash an MP4's contents together with the GIF settings.
+    
+    Used instead of modification times to decide whether a GIF is up to date,
+    so re-saving a bit-identical MP4 doesn't trigger a re-encode. The file is
+    streamed in 1 MiB chunks; xxhash is used when installed, SHA-1 otherwise.
+    
+    Args:
+        mp4_path: Path to input MP4 file
+        fps: Frames per second for GIF
+        scale: Width the GIF is scaled to
+        
+    Returns:
+        Digest string prefixed with the hash algorithm name
+    """
+    if xxhash is not None:
+        name, h = "xxh64", xxhash.xxh64()
+    else:
+        name, h = "sha1", hashlib.sha1()
+    
+    h.update(f"fps={fps},scale={scale};".encode())
+    with open(mp4_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    
+    return f"{name}:{h.hexdigest()}"
+
+
+def digest_path(gif_path):
+    """Sidecar file holding the source digest a GIF was made from."""
+    return gif_path.with_name(gif_path.name + '.hash')
+
+
 def find_output_folders(base_dir="."):
     """Find all directories ending with '_output'."""
     base_path = Path(base_dir)
@@ -77,8 +193,18 @@ def find_mp4_files(folder):
     return list(folder.glob("*.mp4"))
 
 
-def main(fps=10, scale=512, verbose=True):
-    """Convert all MP4 files to GIF in output folders."""
+def main(fps=DEFAULT_FPS, scale=DEFAULT_SCALE, verbose=True, palette=None):
+    """
+    Convert all MP4 files to GIF in output folders.
+    
+    Args:
+        fps: Frames per second for GIF
+        scale: Width to scale GIF to in pixels
+        verbose: Whether to print progress
+        palette: Palette PNG to use for every GIF. If None, a shared
+            palette.png is generated (and regenerated only when the set of
+            MP4s changes); if that fails, each GIF gets its own palette.
+    """
     
     print("=" * 60)
     print("MP4 to GIF Converter")
@@ -101,7 +227,9 @@ def main(fps=10, scale=512, verbose=True):
     total_converted = 0
     total_errors = 0
     
-    # Process each output folder
+    # Collect conversion jobs from each output folder
+    jobs = []
+    source_digests = []
     for folder in output_folders:
         mp4_files = find_mp4_files(folder)
         
@@ -117,32 +245,71 @@ def main(fps=10, scale=512, verbose=True):
             gif_name = f"{mp4_file.stem}_{scale}px.gif"
             gif_file = mp4_file.parent / gif_name
             
-            # Skip if GIF already exists and is newer than MP4
-            if gif_file.exists() and gif_file.stat().st_mtime > mp4_file.stat().st_mtime:
-                if verbose:
-                    print(f"⏭️  Skipping {mp4_file.name} (GIF already up-to-date)")
-                continue
-            
-            # Convert MP4 to GIF
-            success = convert_mp4_to_gif(
-                mp4_file, 
-                gif_file, 
-                fps=fps, 
-                scale=scale, 
-                verbose=verbose
-            )
+            # Skip if GIF already exists and was made from identical content.
+            # GIFs from before the digest sidecar fall back to the mtime check
+            # once and get a sidecar recorded.
+            digest = source_digest(mp4_file, fps, scale)
+            source_digests.append(digest)
+            sidecar = digest_path(gif_file)
+            if gif_file.exists():
+                if sidecar.exists():
+                    up_to_date = sidecar.read_text().strip() == digest
+                else:
+                    up_to_date = gif_file.stat().st_mtime > mp4_file.stat().st_mtime
+                    if up_to_date:
+                        sidecar.write_text(digest)
+                
+                if up_to_date:
+                    if verbose:
+                        print(f"⏭️  Skipping {mp4_file.name} (GIF already up-to-date)")
+                    continue
             
-            if success:
+            jobs.append((mp4_file, gif_file, digest))
+    
+    print()
+    
+    # Use one palette for every GIF. The shared palette is keyed by the digests
+    # of all MP4s, so it's only regenerated when the input set changes.
+    palette_path = Path(palette) if palette is not None else None
+    if palette_path is None and jobs:
+        palette_path = Path("palette.png")
+        palette_digest = hashlib.sha1(''.join(sorted(source_digests)).encode()).hexdigest()
+        palette_sidecar = digest_path(palette_path)
+        if not (palette_path.exists() and palette_sidecar.exists()
+                and palette_sidecar.read_text().strip() == palette_digest):
+            all_mp4s = [mp4_file for folder in output_folders for mp4_file in find_mp4_files(folder)]
+            if make_shared_palette(all_mp4s, palette_path, verbose=verbose):
+                palette_sidecar.write_text(palette_digest)
+            else:
+                palette_path = None
+        elif verbose:
+            print(f"Using cached shared palette: {palette_path}")
+        print()
+    
+    # Each conversion is its own ffmpeg process, so a thread per job is enough
+    # to run several at once. Half the cores, as ffmpeg multithreads a little.
+    max_workers = max(1, (os.cpu_count() or 1) // 2)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(convert_mp4_to_gif, mp4_file, gif_file, fps=fps, scale=scale, verbose=False, palette_path=palette_path): (mp4_file, gif_file, digest)
+            for mp4_file, gif_file, digest in jobs
+        }
+        
+        for future in as_completed(futures):
+            mp4_file, gif_file, digest = futures[future]
+            if future.result():
+                digest_path(gif_file).write_text(digest)
                 total_converted += 1
-                # Show file sizes
-                mp4_size = mp4_file.stat().st_size / 1024 / 1024  # MB
-                gif_size = gif_file.stat().st_size / 1024 / 1024  # MB
                 if verbose:
+                    print(f"✓ Successfully converted: {gif_file}")
+                    # Show file sizes
+                    mp4_size = mp4_file.stat().st_size / 1024 / 1024  # MB
+                    gif_size = gif_file.stat().st_size / 1024 / 1024  # MB
                     print(f"   📊 Size: {mp4_size:.1f}MB → {gif_size:.1f}MB")
             else:
                 total_errors += 1
-        
-        print()
+    
+    print()
     
     # Summary
     print("=" * 60)
@@ -158,19 +325,22 @@ def main(fps=10, scale=512, verbose=True):
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Convert MP4 files to GIF in output folders')
-    parser.add_argument('--fps', type=int, default=10, 
+    parser.add_argument('--fps', type=int, default=DEFAULT_FPS, 
                        help='Frames per second for GIF (default: 10)')
-    parser.add_argument('--scale', type=int, default=512, 
+    parser.add_argument('--scale', type=int, default=DEFAULT_SCALE, 
                        help='Width to scale GIF to in pixels (default: 512)')
     parser.add_argument('--quiet', action='store_true', 
                        help='Suppress verbose output')
+    parser.add_argument('--palette', type=str, default=None,
+                       help='Palette PNG to use for all GIFs (default: generate a shared palette.png)')
     
     args = parser.parse_args()
     
     success = main(
         fps=args.fps, 
         scale=args.scale, 
-        verbose=not args.quiet
+        verbose=not args.quiet,
+        palette=args.palette
     )
     
     exit(0 if success else 1)
\ No newline at end of file
@@ -8,15 +8,66 @@ Creates side-by-side comparison images:
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
+import cv2
 from pathlib import Path
 import argparse
-from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Threads for reading PNGs; OpenCV releases the GIL while decoding
+LOAD_WORKERS = 8
 
 
 def load_image(image_path):
-    """Load image as numpy array."""
-    return np.array(Image.open(image_path))
+    """
+    Load image as numpy array (RGB channel order).
+    
+    Any alpha channel is dropped and grayscale is expanded, so PNGs written
+    as RGBA (older matplotlib output) and RGB can be placed side by side.
+    """
+    img = cv2.imread(str(image_path), cv2.IMREAD_COLOR)
+    if img is None:
+        raise IOError(f"Could not read image: {image_path}")
+    
+    # OpenCV decodes to BGR; convert to RGB for consistency with the other scripts
+    cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=img)
+    return img
+
+
+def load_climatology(climatology_path):
+    """
+    Load the climatology image memory-mapped from an .npy cache.
+    
+    The PNG is decoded once into a .npy file next to it; later runs map that
+    file read-only instead of decoding the PNG again. The cache is rebuilt if
+    the PNG is newer, or if it holds another channel layout (an RGBA cache
+    from before images were loaded as RGB).
+    """
+    cache_path = climatology_path.with_suffix('.npy')
+    
+    if cache_path.exists() and cache_path.stat().st_mtime >= climatology_path.stat().st_mtime:
+        cached = np.load(cache_path, mmap_mode='r')
+        if cached.ndim == 3 and cached.shape[2] == 3:
+            return cached
+    
+    img = load_image(climatology_path)
+    try:
+        np.save(cache_path, img)
+    except OSError as e:
+        print(f"Warning: could not cache climatology to {cache_path}: {e}")
+        return img
+    
+    return np.load(cache_path, mmap_mode='r')
+
+
+def resize_to_height(img, height):
+    """Resize image to the given height, preserving aspect ratio (Lanczos)."""
+    if img.shape[0] == height:
+        return img
+    aspect_ratio = img.shape[1] / img.shape[0]
+    new_width = int(height * aspect_ratio)
+    return cv2.resize(np.ascontiguousarray(img), (new_width, height),
+                      interpolation=cv2.INTER_LANCZOS4)
 
 
 def create_side_by_side(images, output_path, layout='horizontal'):
@@ -36,17 +87,19 @@ def create_side_by_side(images, output_path, layout='horizontal'):
         resized_images = []
         for img in images:
             if img.shape[0] != min_height or img.shape[1] != min_width:
-                from PIL import Image as PILImage
-                pil_img = PILImage.fromarray(img)
-                pil_img = pil_img.resize((min_width, min_height), PILImage.Resampling.LANCZOS)
-                resized_images.append(np.array(pil_img))
+                resized_images.append(cv2.resize(np.ascontiguousarray(img), (min_width, min_height),
+                                                 interpolation=cv2.INTER_LANCZOS4))
             else:
                 resized_images.append(img)
         
         # Create 2x2 grid: top row = [0, 1], bottom row = [2, 3]
-        top_row = np.concatenate([resized_images[0], resized_images[1]], axis=1)
-        bottom_row = np.concatenate([resized_images[2], resized_images[3]], axis=1)
-        concatenated = np.concatenate([top_row, bottom_row], axis=0)
+        # Copy each tile straight into a preallocated canvas (no row temporaries)
+        concatenated = np.empty((2 * min_height, 2 * min_width) + resized_images[0].shape[2:],
+                                dtype=resized_images[0].dtype)
+        concatenated[:min_height, :min_width] = resized_images[0]
+        concatenated[:min_height, min_width:] = resized_images[1]
+        concatenated[min_height:, :min_width] = resized_images[2]
+        concatenated[min_height:, min_width:] = resized_images[3]
         
     else:
         # Horizontal layout (default)
@@ -55,23 +108,23 @@ def create_side_by_side(images, output_path, layout='horizontal'):
         resized_images = []
         
         for img in images:
-            if img.shape[0] != min_height:
-                # Resize to match minimum height while preserving aspect ratio
-                from PIL import Image as PILImage
-                pil_img = PILImage.fromarray(img)
-                aspect_ratio = img.shape[1] / img.shape[0]
-                new_width = int(min_height * aspect_ratio)
-                pil_img = pil_img.resize((new_width, min_height), PILImage.Resampling.LANCZOS)
-                resized_images.append(np.array(pil_img))
-            else:
-                resized_images.append(img)
+            # Resize to match minimum height while preserving aspect ratio
+            resized_images.append(resize_to_height(img, min_height))
         
-        # Concatenate horizontally
-        concatenated = np.concatenate(resized_images, axis=1)
-    
-    # Save using PIL with lossless compression
-    pil_result = Image.fromarray(concatenated)
-    pil_result.save(output_path, format='PNG', compress_level=1, dpi=(300, 300))
+        # Concatenate horizontally into a preallocated canvas
+        total_width = sum(img.shape[1] for img in resized_images)
+        concatenated = np.empty((min_height, total_width) + resized_images[0].shape[2:],
+                                dtype=resized_images[0].dtype)
+        x = 0
+        for img in resized_images:
+            concatenated[:, x:x + img.shape[1]] = img
+            x += img.shape[1]
+    
+    # Save with OpenCV's libpng writer at fast (still lossless) compression.
+    # The canvas is our own buffer, so swap back to BGR in place.
+    cv2.cvtColor(concatenated, cv2.COLOR_RGB2BGR, dst=concatenated)
+    if not cv2.imwrite(str(output_path), concatenated, [cv2.IMWRITE_PNG_COMPRESSION, 1]):
+        raise IOError(f"Could not write image: {output_path}")
     
     print(f"✓ Created: {output_path}")
 
@@ -100,7 +153,7 @@ def process_random_seasonal():
         return
     
     climatology_path = climatology_files[0]  # Use first climatology image
-    climatology_img = load_image(climatology_path)
+    climatology_img = load_climatology(climatology_path)
     
     # Process each seasonal image
     seasonal_files = list(seasonal_dir.glob("*.png"))
@@ -112,14 +165,24 @@ def process_random_seasonal():
     print(f"Found {len(seasonal_files)} seasonal images")
     print(f"Using climatology: {climatology_path.name}")
     
-    for seasonal_file in seasonal_files:
+    # Decode all seasonal images concurrently
+    with ThreadPoolExecutor(max_workers=LOAD_WORKERS) as executor:
+        seasonal_imgs = list(executor.map(load_image, seasonal_files))
+    
+    # Shrink the climatology once per pair height (the smaller of the two
+    # images), rather than inside every create_side_by_side call. Each pair
+    # gets exactly the resize create_side_by_side would have made.
+    climatology_by_height = {}
+    
+    for seasonal_file, seasonal_img in zip(seasonal_files, seasonal_imgs):
         print(f"Processing: {seasonal_file.name}")
         
-        # Load seasonal image
-        seasonal_img = load_image(seasonal_file)
+        height = min(seasonal_img.shape[0], climatology_img.shape[0])
+        if height not in climatology_by_height:
+            climatology_by_height[height] = resize_to_height(climatology_img, height)
         
         # Create comparison
-        images = [seasonal_img, climatology_img]
+        images = [seasonal_img, climatology_by_height[height]]
         
         # Output filename
         output_name = f"comparison_{seasonal_file.stem}_vs_climatology.png"
@@ -154,7 +217,7 @@ def process_progressive_frames():
         return
     
     climatology_path = climatology_files[0]
-    climatology_img = load_image(climatology_path)
+    climatology_img = load_climatology(climatology_path)
     
     # Find progressive frame files
     frame_files = sorted(frames_dir.glob("progressive_frame_*.png"))
@@ -200,9 +263,13 @@ def process_progressive_frames():
         print(f"Available frames: {available}")
         return
     
-    # Load required frame images
-    single_img = load_image(frames_by_number[1])    # 1 image
-    avg2_img = load_image(frames_by_number[2])      # 2 images average
+    # Load required frame images (and the 8-image average if present)
+    # concurrently; the 8-image frame is usually one of the required ones
+    frame_nums = list(dict.fromkeys(required_frames + ([frame_8_num] if frame_8_num else [])))
+    with ThreadPoolExecutor(max_workers=LOAD_WORKERS) as executor:
+        frame_imgs = dict(zip(frame_nums, executor.map(load_image, [frames_by_number[num] for num in frame_nums])))
+    single_img = frame_imgs[1]    # 1 image
+    avg2_img = frame_imgs[2]      # 2 images average
     
     print(f"Loaded frames: {[1, 2]}")
     
@@ -215,7 +282,7 @@ def process_progressive_frames():
     
     # Create 4-column comparison if we have frame for 8-image average
     if frame_8_num:
-        avg8_img = load_image(frames_by_number[frame_8_num])
+        avg8_img = frame_imgs[frame_8_num]
         print(f"Creating 4-column comparison (using frame {frame_8_num} for 8-image average)...")
         
         images_4col = [single_img, avg2_img, avg8_img, climatology_img]
@@ -7,50 +7,152 @@ by averaging images across time periods, and outputs results as PNG or MP4.
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
 from datetime import datetime, timedelta
-from typing import List, Optional, Union
+from typing import List, Optional, Tuple, Union
 import os
 from pathlib import Path
 import warnings
 import hashlib
-import shutil
+import subprocess
+import tempfile
+import sys
 import multiprocessing as mp
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import logging
 import io
 from contextlib import redirect_stdout, redirect_stderr
+from functools import lru_cache
 
 # Silence noisy warnings 
 warnings.filterwarnings("ignore", category=FutureWarning)
 
-def _download_worker(target_time, sat_num, domain, return_dict):
+def _download_worker(target_time, sat_num, domain, coarsening_factor=1):
     """
-    Download a single GOES image in a dedicated subprocess to avoid the
-    memory leaks observed in the goes2go library. The RGB numpy array is
-    returned via a shared dict so literally only the array survives.
+    Download a single GOES image in a pool worker process to avoid the
+    memory leaks observed in the goes2go library. Workers are recycled after
+    every task, so literally only the returned RGB numpy array survives.
+    
+    The image is coarsened here rather than in the parent, so only the
+    coarsened array is pickled back through the pool's result pipe.
     """
-    from goes2go import GOES
-    import numpy as np
-    from pathlib import Path
-    import shutil
+    if GOES is None:
+        raise ImportError("goes2go package is required. Install with: pip install goes2go")
 
     G = GOES(satellite=sat_num, domain=domain)
-    # Suppress verbose console output from goes2go
-    with io.StringIO() as buf, redirect_stdout(buf), redirect_stderr(buf):
-        ds = G.nearesttime(target_time, download=True)
+    # Download into a private temporary directory, in memory where there is a
+    # tmpfs, and read the image before it is removed: the file is written and
+    # read exactly once, so it never needs to reach the disk
+    with tempfile.TemporaryDirectory(prefix="goes_", dir=DOWNLOAD_TMP_DIR) as save_dir:
+        # Suppress verbose console output from goes2go
+        with io.StringIO() as buf, redirect_stdout(buf), redirect_stderr(buf):
+            ds = G.nearesttime(target_time, download=True, save_dir=save_dir)
 
-    # Clean up download directory to keep things tidy
-    data_dir = Path("/Users/thomas/data")
-    if data_dir.exists():
-        shutil.rmtree(data_dir)
+        if ds is None:
+            return None
 
-    if ds is None:
-        return_dict["data"] = None
-        return
+        try:
+            data = np.asarray(ds.rgb.TrueColor())
+        finally:
+            # Release the file handle before the directory goes
+            ds.close()
 
-    data = np.nan_to_num(ds.rgb.TrueColor(), nan=0.0)
-    return_dict["data"] = data
+    return coarsen_true_color(data, coarsening_factor)
+
+
+def _download_task(task):
+    """imap-friendly wrapper: returns (target_time, data, error message)."""
+    target_time = task[0]
+    try:
+        return target_time, _download_worker(*task), None
+    except Exception as e:
+        return target_time, None, str(e)
+
+
+# Concurrent download processes. Downloads are network-bound, so this doesn't
+# track the core count; it's capped by memory, as each worker holds one
+# full-resolution image. The pool is per process, which is why scripts with
+# worker processes download from the parent first (cache_goes_images).
+DOWNLOAD_PROCESSES = 8
+
+# Room each concurrent download needs in the temporary directory (a full disk
+# MCMIP file is a few hundred MB)
+DOWNLOAD_TMP_BYTES = 512 * 1024**2
+
+
+def _pick_download_tmp_dir(path="/dev/shm"):
+    """
+    Choose where downloads are written before being read.
+    
+    tmpfs avoids a round trip through the disk, but it is often small (Docker
+    gives containers 64 MB), so it's only used when it has room for every
+    concurrent download; otherwise the system temporary directory is used.
+    
+    Returns:
+        The tmpfs path, or None for the default temporary directory
+    """
+    try:
+        st = os.statvfs(path)
+    except OSError:
+        return None
+    if st.f_bavail * st.f_frsize < DOWNLOAD_PROCESSES * DOWNLOAD_TMP_BYTES:
+        return None
+    return path
+
+
+DOWNLOAD_TMP_DIR = _pick_download_tmp_dir()
+
+# Downloads per worker before it is replaced (the leak workaround). Raising it
+# saves process startups at the cost of that much leaked memory per worker.
+DOWNLOAD_TASKS_PER_WORKER = 1
+# Threads summing cache hits, each into its own partial sum. Summing is
+# memory-bound, so a few threads reach full bandwidth; each extra one costs
+# another accumulator the size of an image.
+CACHE_SUM_THREADS = 4
+_download_pool = None
+_download_pool_pid = None
+# Callers on several threads (e.g. prefetching cache reads) may all miss the
+# cache at once; only one of them may create the pool
+_download_pool_lock = threading.Lock()
+
+
+def _get_download_pool():
+    """
+    Return the persistent download pool, creating it on first use.
+    
+    Replaces spawning a fresh Process plus Manager server per image. Each
+    worker still handles DOWNLOAD_TASKS_PER_WORKER downloads before being
+    recycled, but worker startup overlaps with other downloads instead
+    of sitting on the critical path. A pool inherited through fork is unusable
+    (its handler threads don't exist in the child), so each process gets its
+    own.
+    
+    Replacement workers are started from the pool's handler thread, and
+    forking a process that runs other threads (numba's, OpenCV's) is unsafe,
+    so workers come from a forkserver with this module preloaded instead.
+    """
+    global _download_pool, _download_pool_pid
+    with _download_pool_lock:
+        if _download_pool is None or _download_pool_pid != os.getpid():
+            if _download_pool is None:
+                ctx = mp.get_context("forkserver")
+                ctx.set_forkserver_preload([__name__])
+            else:
+                # A forked child (e.g. a ProcessPoolExecutor worker) inherits its
+                # parent's forkserver connection, but processes started through
+                # it aren't the child's own, so it spawns its workers instead
+                ctx = mp.get_context("spawn")
+            _download_pool_pid = os.getpid()
+            _download_pool = ctx.Pool(
+                processes=DOWNLOAD_PROCESSES,
+                maxtasksperchild=DOWNLOAD_TASKS_PER_WORKER
+            )
+            # Shut down before interpreter teardown, which the pool's own
+            # finalizer can't cope with
+            atexit.register(_download_pool.terminate)
+        return _download_pool
 
 try:
     from goes2go import GOES
@@ -70,6 +172,11 @@ except ImportError:
     print("Warning: opencv-python not installed. Install with: pip install opencv-python")
     cv2 = None
 
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
 
 def download_and_average_goes_images(
     *,
@@ -105,12 +212,6 @@ def download_and_average_goes_images(
         numpy array of averaged image data
     """
     
-    if GOES is None:
-        raise ImportError("goes2go package is required. Install with: pip install goes2go")
-    
-    if xr is None:
-        raise ImportError("xarray package is required. Install with: pip install xarray")
-    
     # Create output and cache directories
     Path(output_path).mkdir(parents=True, exist_ok=True)
     if use_cache:
@@ -133,86 +234,17 @@ def download_and_average_goes_images(
         print(f"Downloading GOES-{sat_num} data for {len(dates)} dates, {len(hours)} hours, {len(minutes)} minutes each")
         print(f"Total time points: {total_times}")
     
-    total_image = None
-    successful_downloads = 0
-    
-    for date in dates:
-        for hour in hours:
-            for minute in minutes:
-                try:
-                    # Create datetime for specific hour and minute
-                    target_time = date.replace(hour=hour, minute=minute, second=0, microsecond=0)
-                
-                    # Create cache filename based on parameters
-                    cache_key = f"goes{sat_num}_{domain}_{target_time.strftime('%Y%m%d_%H%M')}_c{coarsening_factor}"
-                    cache_file = Path(cache_dir) / f"{cache_key}.npy"
-                
-                    # Check cache first
-                    if use_cache and cache_file.exists():
-                        if verbose:
-                            print(f"Loading from cache: {target_time.strftime('%Y-%m-%d %H:%M UTC')}")
-                        data = np.load(cache_file)
-                    else:
-                        try:
-                            # Download GOES data in a separate subprocess to avoid goes2go
-                            # memory bloat.  NOTE: I know this is a brutalist approach
-                            manager = mp.Manager()
-                            return_dict = manager.dict()
-                            p = mp.Process(
-                                target=_download_worker,
-                                args=(target_time, sat_num, domain, return_dict),
-                            )
-                            p.start()
-                            p.join()
-
-                            data = return_dict.get("data", None)
-                            if data is None:
-                                if verbose:
-                                    print(f"No data available for {target_time}")
-                                continue
-                        except Exception as e:
-                            if "truncated file" in str(e) or "Unable to synchronously open file" in str(e):
-                                if verbose:
-                                    print(f"  ❌ Corrupted file detected for {target_time.strftime('%Y-%m-%d %H:%M UTC')}")
-                                    print(f"  🗑️  Cleaning up corrupted downloads...")
-                                # Clean up potentially corrupted downloads
-                                #data_dir = Path("/Users/thomas/data")
-                                #if data_dir.exists():
-                                #    import shutil
-                                #    shutil.rmtree(data_dir)
-                                #    if verbose:
-                                #        print(f"  ✓ Cleaned up download directory")
-                            if verbose:
-                                print(f"  ❌ Error downloading: {target_time.strftime('%Y-%m-%d %H:%M UTC')}: {e}")
-                            continue
-                    
-                        # Handle NaN values - preserve RGB channels
-                        # data = np.nan_to_num(data, nan=0.0)  # Already done in subprocess
-                        
-                        # Coarsen if requested
-                        if coarsening_factor > 1:
-                            data = coarsen_by_averaging(data, coarsening_factor)
-                        
-                        # Cache the coarsened data
-                        if use_cache:
-                            np.save(cache_file, data)
-                            if verbose:
-                                print(f"Cached coarsened data: {cache_file}")
-                    
-                    # Initialize total_image on first successful download
-                    if total_image is None:
-                        total_image = data.astype(np.float64)  # Use float64 for accumulation
-                    else:
-                        total_image += data.astype(np.float64)
-                    
-                    # Delete current image data from memory
-                    del data
-                    
-                    successful_downloads += 1
-                    
-                except Exception as e:
-                    print(f"Error downloading {target_time}: {str(e)}")
-                    continue
+    total_image, successful_downloads = sum_goes_images(
+        hours=hours,
+        dates=dates,
+        satellite=satellite,
+        coarsening_factor=coarsening_factor,
+        domain=domain,
+        use_cache=use_cache,
+        cache_dir=cache_dir,
+        verbose=verbose,
+        minutes=minutes
+    )
     
     if total_image is None:
         raise RuntimeError("No images were successfully downloaded")
@@ -223,7 +255,8 @@ def download_and_average_goes_images(
     # Average all images by dividing total by count
     if verbose:
         print("Computing climatological average...")
-    averaged_image = (total_image / successful_downloads).astype(np.float32)
+    # In place: the sum isn't needed afterwards
+    averaged_image = np.multiply(total_image, np.float32(1.0 / successful_downloads), out=total_image)
     
     # Save output
     if save_format.lower() == "png":
@@ -234,6 +267,466 @@ def download_and_average_goes_images(
     return averaged_image
 
 
+def sum_goes_images(
+    *,
+    hours: List[int],
+    dates: List[datetime],
+    satellite: str = "east",
+    coarsening_factor: int = 2,
+    domain: str = "F",
+    use_cache: bool = True,
+    cache_dir: str = "/Volumes/Thomas/GOES Imagery",
+    verbose: bool = True,
+    minutes: List[int] = [0],
+    dtype: type = np.float32,
+    download: bool = True
+) -> Tuple[Optional[np.ndarray], int]:
+    """
+    Sum GOES images without normalizing, for callers that combine partial sums.
+    
+    Args:
+        hours: List of hours (0-23) to download data for
+        dates: List of datetime objects for specific dates
+        satellite: "east" or "west"
+        coarsening_factor: Factor to coarsen images (default 2, 2x2 averaging)
+        domain: Domain (C=CONUS, F=Full Disk, M1/M2=Mesoscale)
+        use_cache: Whether to use local file caching (default True)
+        cache_dir: Directory for cached .npy files
+        verbose: Whether to print progress messages
+        minutes: List of minutes (0, 30) for sub-hourly sampling (default [0])
+        dtype: Accumulator dtype. float32 is plenty for averages of values in
+            [0, 1] (the rounding error stays far below one 8-bit level) and
+            halves the memory traffic of float64
+        download: Whether to download images missing from the cache. Worker
+            processes pass False after the parent has filled the cache with
+            cache_goes_images, so all downloads share the parent's pool
+        
+    Returns:
+        Tuple of (sum, count): image sum (None if nothing could be loaded) and
+        number of images summed
+    """
+    sat_num = 16 if satellite.lower() == "east" else 17
+    
+    def new_totals():
+        # "image" sums float images (values in [0, 1]); "levels" sums 8-bit
+        # cache hits undequantized, as levels 0-255, to be scaled once at the end
+        return {"image": None, "levels": None, "count": 0}
+    
+    def accumulate(totals, data):
+        key = "levels" if data.dtype == np.uint8 else "image"
+        # Initialize the sum on the first image
+        if totals[key] is None:
+            totals[key] = data.astype(dtype)
+        else:
+            # Add in place, casting on the fly rather than via a temporary copy
+            np.add(totals[key], data, out=totals[key], casting='unsafe')
+        totals["count"] += 1
+    
+    def combine(totals, partial):
+        for key in ("image", "levels"):
+            if partial[key] is None:
+                continue
+            if totals[key] is None:
+                totals[key] = partial[key]
+            else:
+                np.add(totals[key], partial[key], out=totals[key])
+        totals["count"] += partial["count"]
+    
+    def sum_cached(times):
+        partial = new_totals()
+        for target_time in times:
+            data = load_goes_image(
+                target_time,
+                satellite=satellite,
+                coarsening_factor=coarsening_factor,
+                domain=domain,
+                use_cache=use_cache,
+                cache_dir=cache_dir,
+                verbose=verbose,
+                mmap_mode='r',
+                dequantize=False
+            )
+            if data is not None:
+                accumulate(partial, data)
+        return partial
+    
+    # Split the time points into cache hits and images that need downloading
+    cached_times = []
+    needs_download = []
+    for date in dates:
+        for hour in hours:
+            for minute in minutes:
+                # Create datetime for specific hour and minute
+                target_time = date.replace(hour=hour, minute=minute, second=0, microsecond=0)
+                
+                cache_file = _goes_cache_file(target_time, sat_num, domain, coarsening_factor, cache_dir)
+                # Images with only a finer cached copy are loaded (and
+                # coarsened) with the cache hits too
+                if use_cache and (_is_cached(cache_file)
+                                  or _finer_cache_file(target_time, sat_num, domain, coarsening_factor, cache_dir)):
+                    cached_times.append(target_time)
+                else:
+                    needs_download.append(target_time)
+    
+    # Start every download on the persistent pool before touching the cache,
+    # so the network fetches run while the cache hits are read and summed below
+    downloads = []
+    if needs_download and download:
+        downloads = _start_downloads(needs_download, sat_num, domain, coarsening_factor)
+    elif needs_download and verbose:
+        print(f"Skipping {len(needs_download)} images missing from the cache")
+    
+    # Cache hits are memory-mapped, so np.add streams them from the page
+    # cache. They are split across threads, each summing its share into its
+    # own partial sum: np.add releases the GIL, so both the reads and the
+    # additions run in parallel, and the partial sums are combined at the end
+    totals = new_totals()
+    n_threads = min(CACHE_SUM_THREADS, len(cached_times))
+    with ThreadPoolExecutor(max_workers=max(n_threads, 1)) as executor:
+        partials = [executor.submit(sum_cached, cached_times[i::n_threads]) for i in range(n_threads)]
+        
+        # Meanwhile collect downloads in completion order
+        for target_time, data, error in downloads:
+            data = _finish_download(
+                target_time,
+                data,
+                error,
+                cache_file=_goes_cache_file(target_time, sat_num, domain, coarsening_factor, cache_dir),
+                use_cache=use_cache,
+                verbose=verbose
+            )
+            if data is not None:
+                accumulate(totals, data)
+        
+        for partial in partials:
+            combine(totals, partial.result())
+    
+    total_image = totals["image"]
+    total_levels = totals["levels"]
+    if total_levels is not None:
+        np.multiply(total_levels, 1.0 / 255.0, out=total_levels, casting='unsafe')
+        if total_image is None:
+            total_image = total_levels
+        else:
+            np.add(total_image, total_levels, out=total_image, casting='unsafe')
+    
+    return total_image, totals["count"]
+
+
+def load_goes_image(
+    target_time: datetime,
+    *,
+    satellite: str = "east",
+    coarsening_factor: int = 2,
+    domain: str = "F",
+    use_cache: bool = True,
+    cache_dir: str = "/Volumes/Thomas/GOES Imagery",
+    verbose: bool = True,
+    mmap_mode: Optional[str] = None,
+    dequantize: bool = True,
+    download: bool = True
+) -> Optional[np.ndarray]:
+    """
+    Load a single coarsened GOES image, from the cache if possible.
+    
+    Args:
+        target_time: Datetime of the image to load
+        satellite: "east" or "west"
+        coarsening_factor: Factor to coarsen images (default 2, 2x2 averaging)
+        domain: Domain (C=CONUS, F=Full Disk, M1/M2=Mesoscale)
+        use_cache: Whether to use local file caching (default True)
+        cache_dir: Directory for cached .npy files
+        verbose: Whether to print progress messages
+        mmap_mode: Passed to np.load for cache hits; 'r' maps the file
+            read-only instead of reading it into memory, which suits callers
+            that only read the image once (e.g. to add it to a sum)
+        dequantize: Whether to convert 8-bit cache files back to float32 in
+            [0, 1]. Pass False to get them as stored (uint8, levels 0-255)
+            and scale later, e.g. once on a sum. Fresh downloads and older
+            float caches are returned as floats either way.
+        download: Whether to download the image if it isn't cached. With
+            False, a cache miss returns None (see sum_goes_images)
+        
+    Returns:
+        numpy array of image data, or None if the image could not be retrieved
+    """
+    sat_num = 16 if satellite.lower() == "east" else 17
+    
+    try:
+        cache_file = _goes_cache_file(target_time, sat_num, domain, coarsening_factor, cache_dir)
+    
+        # Check cache first
+        if use_cache and _is_cached(cache_file):
+            if verbose:
+                print(f"Loading from cache: {target_time.strftime('%Y-%m-%d %H:%M UTC')}")
+            data = np.load(cache_file, mmap_mode=mmap_mode)
+            if dequantize and data.dtype == np.uint8:
+                return data * np.float32(1.0 / 255.0)
+            return data
+        
+        # Next, coarsen a finer cached copy rather than downloading it again
+        finer = _finer_cache_file(target_time, sat_num, domain, coarsening_factor, cache_dir) if use_cache else None
+        if finer is not None:
+            finer_factor, finer_file = finer
+            if verbose:
+                print(f"Coarsening c{finer_factor} cache: {target_time.strftime('%Y-%m-%d %H:%M UTC')}")
+            data = np.load(finer_file, mmap_mode='r')
+            if data.dtype == np.uint8:
+                data = data * np.float32(1.0 / 255.0)
+            data = coarsen_by_averaging(data, coarsening_factor // finer_factor)
+            return _finish_download(
+                target_time,
+                data,
+                None,
+                cache_file=cache_file,
+                use_cache=use_cache,
+                verbose=verbose
+            )
+        
+        if not download:
+            return None
+        
+        # Download GOES data in a separate process to avoid goes2go memory
+        # bloat.  NOTE: I know this is a brutalist approach
+        _, data, error = _get_download_pool().apply(
+            _download_task, ((target_time, sat_num, domain, coarsening_factor),)
+        )
+        return _finish_download(
+            target_time,
+            data,
+            error,
+            cache_file=cache_file,
+            use_cache=use_cache,
+            verbose=verbose
+        )
+        
+    except Exception as e:
+        print(f"Error downloading {target_time}: {str(e)}")
+        return None
+
+
+def _start_downloads(times, sat_num, domain, coarsening_factor):
+    """
+    Queue downloads of times on the shared pool.
+    
+    imap_unordered dispatches immediately, so the fetches start before the
+    returned iterator is read; it yields (target_time, data, error message)
+    in completion order.
+    """
+    # Only downloads need goes2go; a fully cached run works without it
+    if GOES is None:
+        raise ImportError("goes2go package is required. Install with: pip install goes2go")
+    
+    if xr is None:
+        raise ImportError("xarray package is required. Install with: pip install xarray")
+    
+    tasks = [(target_time, sat_num, domain, coarsening_factor) for target_time in times]
+    return _get_download_pool().imap_unordered(_download_task, tasks, chunksize=1)
+
+
+def cache_goes_images(
+    times: List[datetime],
+    *,
+    satellite: str = "east",
+    coarsening_factor: int = 2,
+    domain: str = "F",
+    cache_dir: str = "/Volumes/Thomas/GOES Imagery",
+    verbose: bool = True
+) -> List[datetime]:
+    """
+    Make sure every image in times is in the cache, downloading the missing ones.
+    
+    Scripts that fan out to worker processes call this in the parent first
+    and have the workers read the cache with download=False. The download
+    pool is per process, so downloading in every worker would multiply
+    DOWNLOAD_PROCESSES by the number of workers; this way the whole run
+    stays within it. Images with a finer cached copy are coarsened into the
+    cache here too, so workers only ever read it.
+    
+    Times whose fetch raised an error (a network error, a corrupt file) are
+    returned, as distinct from times with no image available: they may
+    succeed on a later run, so callers shouldn't store results computed
+    without them.
+    
+    Args:
+        times: Datetimes of the images to cache
+        satellite: "east" or "west"
+        coarsening_factor: Factor to coarsen images (default 2, 2x2 averaging)
+        domain: Domain (C=CONUS, F=Full Disk, M1/M2=Mesoscale)
+        cache_dir: Directory for cached .npy files
+        verbose: Whether to print progress messages
+        
+    Returns:
+        List of times whose download or coarsening failed with an error
+    """
+    sat_num = 16 if satellite.lower() == "east" else 17
+    
+    needs_coarsening = []
+    needs_download = []
+    # Callers' time lists can overlap (e.g. windows wrapping around the year);
+    # each image is fetched once, as two concurrent fetches would both write
+    # the same cache file
+    for target_time in dict.fromkeys(times):
+        if _is_cached(_goes_cache_file(target_time, sat_num, domain, coarsening_factor, cache_dir)):
+            continue
+        if _finer_cache_file(target_time, sat_num, domain, coarsening_factor, cache_dir):
+            needs_coarsening.append(target_time)
+        else:
+            needs_download.append(target_time)
+    
+    if verbose and (needs_coarsening or needs_download):
+        print(f"Caching {len(needs_download)} downloads and {len(needs_coarsening)} coarsened copies")
+    
+    def coarsen(target_time):
+        return load_goes_image(
+            target_time,
+            satellite=satellite,
+            coarsening_factor=coarsening_factor,
+            domain=domain,
+            use_cache=True,
+            cache_dir=cache_dir,
+            verbose=verbose,
+            download=False
+        )
+    
+    downloads = []
+    if needs_download:
+        downloads = _start_downloads(needs_download, sat_num, domain, coarsening_factor)
+    
+    # Coarsen finer copies on threads (OpenCV and NumPy release the GIL)
+    # while this thread collects the downloads
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, min(CACHE_SUM_THREADS, len(needs_coarsening)))) as executor:
+        coarsened = executor.map(coarsen, needs_coarsening)
+        
+        for target_time, data, error in downloads:
+            downloaded = data is not None
+            data = _finish_download(
+                target_time,
+                data,
+                error,
+                cache_file=_goes_cache_file(target_time, sat_num, domain, coarsening_factor, cache_dir),
+                use_cache=True,
+                verbose=verbose
+            )
+            # No data without an error means there is no image for that time
+            if error is not None or (downloaded and data is None):
+                failed.append(target_time)
+        
+        # A finer copy exists, so failing to coarsen it is always an error
+        failed.extend(t for t, data in zip(needs_coarsening, coarsened) if data is None)
+    
+    return failed
+
+
+def _goes_cache_file(target_time, sat_num, domain, coarsening_factor, cache_dir):
+    """Cache filename for one coarsened image, based on its parameters."""
+    cache_key = f"goes{sat_num}_{domain}_{target_time.strftime('%Y%m%d_%H%M')}_c{coarsening_factor}"
+    return Path(cache_dir) / f"{cache_key}.npy"
+
+
+def _finer_cache_file(target_time, sat_num, domain, coarsening_factor, cache_dir):
+    """
+    Find a cached copy of an image at a finer coarsening factor that divides
+    coarsening_factor (e.g. c2 or c1 for c4), so switching to a coarser
+    factor doesn't mean downloading everything again.
+    
+    Returns:
+        Tuple of (factor, cache file), preferring the coarsest such copy as
+        the least work to coarsen further, or None if there is none
+    """
+    for factor in range(coarsening_factor - 1, 0, -1):
+        if coarsening_factor % factor == 0:
+            cache_file = _goes_cache_file(target_time, sat_num, domain, factor, cache_dir)
+            if _is_cached(cache_file):
+                return factor, cache_file
+    return None
+
+
+# File names in each cache directory, listed once per process and kept up to
+# date as downloads are cached
+_cache_listings = {}
+
+
+def _cache_listing(cache_dir):
+    """
+    Set of file names in cache_dir, listed on first use.
+    
+    A re-run checks thousands of time points; one directory listing replaces
+    a stat per file, which adds up on the external and network drives the
+    cache usually lives on. Files added by other processes after the listing
+    aren't seen and are simply downloaded again.
+    """
+    cache_dir = str(cache_dir)
+    names = _cache_listings.get(cache_dir)
+    if names is None:
+        try:
+            names = set(os.listdir(cache_dir))
+        except FileNotFoundError:
+            names = set()
+        # setdefault, so threads listing at the same time share one set
+        names = _cache_listings.setdefault(cache_dir, names)
+    return names
+
+
+def _is_cached(cache_file):
+    """Whether cache_file exists, according to its directory's listing."""
+    return cache_file.name in _cache_listing(cache_file.parent)
+
+
+def _finish_download(target_time, data, error, *, cache_file, use_cache, verbose):
+    """
+    Cache a freshly downloaded (already coarsened) image, or one coarsened
+    from a finer cached copy.
+    
+    Returns:
+        numpy array of image data, or None if the download failed
+    """
+    if error is not None:
+        if "truncated file" in error or "Unable to synchronously open file" in error:
+            if verbose:
+                print(f"  ❌ Corrupted file detected for {target_time.strftime('%Y-%m-%d %H:%M UTC')}")
+                print(f"  🗑️  Cleaning up corrupted downloads...")
+            # The corrupted download was removed with the worker's temporary
+            # download directory, so the next attempt fetches it afresh
+        if verbose:
+            print(f"  ❌ Error downloading: {target_time.strftime('%Y-%m-%d %H:%M UTC')}: {error}")
+        return None
+    
+    if data is None:
+        if verbose:
+            print(f"No data available for {target_time}")
+        return None
+    
+    try:
+        # Handle NaN values - preserve RGB channels
+        # data = np.nan_to_num(data, nan=0.0)  # Already done in the worker
+        # Coarsening is also done in the worker
+        
+        # Cache the coarsened data as 8-bit: a quarter of the float32 size
+        # (an eighth of float64), and all the precision the output has
+        if use_cache:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            np.save(cache_file, quantize_to_uint8(data))
+            _cache_listing(cache_file.parent).add(cache_file.name)
+            if verbose:
+                print(f"Cached coarsened data: {cache_file}")
+        
+        return data
+        
+    except Exception as e:
+        print(f"Error downloading {target_time}: {str(e)}")
+        return None
+
+
+def quantize_to_uint8(data: np.ndarray) -> np.ndarray:
+    """Round values in [0, 1] to 8-bit levels for caching."""
+    levels = np.multiply(data, 255.0, dtype=np.float32)
+    np.rint(levels, out=levels)
+    np.clip(levels, 0.0, 255.0, out=levels)
+    return levels.astype(np.uint8)
+
+
 def coarsen_by_averaging(data: np.ndarray, factor: int) -> np.ndarray:
     """
     Coarsen RGB array by averaging over blocks.
@@ -255,21 +748,100 @@ def coarsen_by_averaging(data: np.ndarray, factor: int) -> np.ndarray:
     
     trimmed = data[:new_h, :new_w, :]
     
-    # Reshape and average - preserve color channels
-    coarsened = trimmed.reshape(new_h // factor, factor, new_w // factor, factor, c).mean(axis=(1, 3))
+    # With an integer factor, INTER_AREA is exactly the block mean, computed
+    # in a single SIMD pass
+    if cv2 is not None and c <= 4:
+        return cv2.resize(np.ascontiguousarray(trimmed), (new_w // factor, new_h // factor),
+                          interpolation=cv2.INTER_AREA)
+    
+    # The default factor of 2 as the mean of the four strided quarter-images:
+    # plain elementwise adds, about 4x faster than the reshaped reductions
+    if factor == 2 and np.issubdtype(trimmed.dtype, np.floating):
+        coarsened = trimmed[0::2, 0::2] + trimmed[1::2, 0::2]
+        coarsened += trimmed[0::2, 1::2]
+        coarsened += trimmed[1::2, 1::2]
+        coarsened *= 0.25
+        return coarsened
+    
+    # Reshape and average - preserve color channels. Two single-axis means
+    # avoid NumPy's slower multi-axis reduction.
+    coarsened = trimmed.reshape(new_h // factor, factor, new_w // factor, factor, c).mean(axis=3).mean(axis=1)
     
     return coarsened
 
 
+if njit is not None:
+    # Serial: it runs in the download workers, which already run
+    # DOWNLOAD_PROCESSES at a time. Cached to disk, as the short-lived
+    # workers would otherwise each compile it afresh.
+    @njit(nogil=True, cache=True)
+    def _coarsen_true_color_kernel(data, out, factor):
+        """Block-mean data into float32 out with NaN as 0, reading each input row once in order."""
+        h, w, c = out.shape
+        scale = np.float32(1.0 / (factor * factor))
+        for i in range(h):
+            out[i] = 0.0
+            for di in range(factor):
+                row = data[i * factor + di]
+                for j in range(w):
+                    for dj in range(factor):
+                        for ch in range(c):
+                            value = row[j * factor + dj, ch]
+                            if value == value:  # Skips NaN
+                                out[i, j, ch] += value
+            for j in range(w):
+                for ch in range(c):
+                    out[i, j, ch] *= scale
+
+
+def coarsen_true_color(data: np.ndarray, factor: int) -> np.ndarray:
+    """
+    Zero the NaNs in a full-resolution RGB image and coarsen it.
+    
+    With numba, both happen in a single compiled pass that reads each input
+    value once and writes float32 block means directly, instead of a full-size
+    nan_to_num copy followed by coarsen_by_averaging.
+    
+    Args:
+        data: 3D numpy array (H, W, C) for RGB, possibly with NaNs
+        factor: Coarsening factor
+        
+    Returns:
+        Coarsened array without NaNs
+    """
+    if njit is None:
+        data = np.nan_to_num(data, nan=0.0)
+        if factor > 1:
+            data = coarsen_by_averaging(data, factor)
+        return data
+    
+    h, w, c = data.shape
+    out = np.empty((h // factor, w // factor, c), dtype=np.float32)
+    _coarsen_true_color_kernel(data, out, factor)
+    return out
+
+
 def save_as_png(data: np.ndarray, output_path: str, filename: str, *, verbose: bool = False):
-    """Save RGB array as PNG image with no decorations."""
-    fig, ax = plt.subplots(figsize=(12, 8))
-    ax.imshow(data, origin='upper')
-    ax.set_axis_off()  # Remove all axes, labels, ticks
+    """
+    Save RGB array as PNG image with no decorations.
+    
+    The pixels are encoded directly at the array's own resolution, rather
+    than rendered through a matplotlib figure. Float data in [0, 1] is
+    quantized with frame_to_uint8; pass an 8-bit frame to skip that.
+    """
+    if data.dtype != np.uint8:
+        data = frame_to_uint8(data)
     
     filepath = Path(output_path) / filename
-    plt.savefig(filepath, dpi=300, bbox_inches='tight', pad_inches=0)
-    plt.close()
+    if cv2 is not None:
+        # Low compression: the frames are large and written once
+        bgr = cv2.cvtColor(data, cv2.COLOR_RGB2BGR)
+        if not cv2.imwrite(str(filepath), bgr, [cv2.IMWRITE_PNG_COMPRESSION, 1]):
+            raise IOError(f"Could not write image: {filepath}")
+    else:
+        # Only imported for this fallback; pyplot is slow to import
+        import matplotlib.pyplot as plt
+        plt.imsave(filepath, data)
     
     if verbose:
         print(f"Saved PNG: {filepath}")
@@ -284,27 +856,266 @@ def save_as_mp4(images: List[np.ndarray], output_path: str, filename: str, *, ve
     if not images:
         return
     
-    # Normalize all images to 0-255 range
-    normalized_images = []
-    for img in images:
-        norm_img = ((img - img.min()) / (img.max() - img.min()) * 255).astype(np.uint8)
-        normalized_images.append(norm_img)
-    
-    h, w = normalized_images[0].shape
+    h, w = images[0].shape[:2]
+    is_color = images[0].ndim == 3
     filepath = str(Path(output_path) / filename)
     
     # Create video writer
     fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(filepath, fourcc, fps, (w, h), isColor=False)
+    out = cv2.VideoWriter(filepath, fourcc, fps, (w, h), isColor=is_color)
     
-    for img in normalized_images:
-        out.write(img)
+    # Normalize each image to 0-255 range into one reused 8-bit buffer:
+    # cv2.normalize does the min/max scaling and cast in a single pass,
+    # instead of three full-size float temporaries per image
+    frame = np.empty(images[0].shape, dtype=np.uint8)
+    for img in images:
+        cv2.normalize(img, frame, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+        if is_color:
+            cv2.cvtColor(frame, cv2.COLOR_RGB2BGR, dst=frame)
+        out.write(frame)
     
     out.release()
     if verbose:
         print(f"Saved MP4: {filepath}")
 
 
+# Values per parallel chunk in the 8-bit conversion kernel
+UINT8_CHUNK = 1 << 16
+
+
+if njit is not None:
+    # No fastmath: it would let the compiler assume away the NaN check
+    @njit(parallel=True, nogil=True)
+    def _frame_to_uint8_kernel(frame, out):
+        """Scale, clip and cast flat frame into flat out in one pass, one static chunk per task."""
+        n = frame.shape[0]
+        n_chunks = (n + UINT8_CHUNK - 1) // UINT8_CHUNK
+        for chunk in prange(n_chunks):
+            start = chunk * UINT8_CHUNK
+            stop = min(start + UINT8_CHUNK, n)
+            for p in range(start, stop):
+                value = frame[p] * 255.0
+                if not value > 0.0:  # Also catches NaN
+                    value = 0.0
+                elif value > 255.0:
+                    value = 255.0
+                out[p] = np.uint8(value)
+
+
+def frame_to_uint8(
+    frame: np.ndarray,
+    *,
+    out: Optional[np.ndarray] = None,
+    scratch: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Scale an RGB frame with values in [0, 1] to 8-bit.
+    
+    Values are clipped to [0, 255] and NaNs are written as 0, so stray
+    out-of-range or NaN pixels in an average cannot wrap around. Pass a uint8
+    `out` and float32 `scratch` of the frame's shape to reuse buffers across
+    frames instead of allocating temporaries.
+    
+    Contiguous float32/float64 frames go through a parallel numba kernel that
+    makes a single pass over memory (when numba is installed), and anything
+    else through NumPy.
+    """
+    if out is None:
+        out = np.empty(frame.shape, dtype=np.uint8)
+    
+    if (njit is not None and frame.dtype in (np.float32, np.float64)
+            and frame.flags.c_contiguous and out.flags.c_contiguous):
+        _frame_to_uint8_kernel(frame.reshape(-1), out.reshape(-1))
+        return out
+    
+    if scratch is None:
+        scratch = np.empty(frame.shape, dtype=np.float32)
+    np.multiply(frame, 255.0, out=scratch, casting='unsafe')
+    # fmax ignores NaN, so clipping the low end also zeroes NaNs in the same pass
+    np.fmax(scratch, 0.0, out=scratch)
+    np.minimum(scratch, 255.0, out=scratch)
+    out[...] = scratch
+    return out
+
+# ffmpeg H.264 encoders and their quality settings, hardware first
+H264_ENCODER_ARGS = {
+    "h264_videotoolbox": ['-b:v', '8M'],
+    "h264_nvenc": ['-b:v', '8M'],
+    "libx264": ['-preset', 'veryfast', '-crf', '20'],
+}
+
+
+@lru_cache(maxsize=None)
+def _pick_h264_encoder() -> str:
+    """
+    Return the first hardware H.264 encoder this ffmpeg can actually use
+    (VideoToolbox on macOS, NVENC elsewhere), falling back to libx264.
+    
+    Encoders can be compiled in without working hardware, so each candidate
+    is checked with a tiny test encode.
+    """
+    candidates = ["h264_videotoolbox"] if sys.platform == "darwin" else ["h264_nvenc"]
+    for encoder in candidates:
+        cmd = [
+            'ffmpeg', '-hide_banner', '-loglevel', 'error',
+            '-f', 'lavfi', '-i', 'color=size=64x64:duration=0.1',
+            '-c:v', encoder, '-f', 'null', '-'
+        ]
+        try:
+            if subprocess.run(cmd, capture_output=True).returncode == 0:
+                return encoder
+        except FileNotFoundError:
+            break
+    return "libx264"
+
+
+def open_video_pipe(filepath: str, width: int, height: int, fps: float) -> subprocess.Popen:
+    """
+    Start an ffmpeg process that encodes raw 8-bit RGB frames as H.264 MP4.
+    
+    Frames are written to the returned process's stdin as raw bytes; close
+    stdin and wait on the process to finish the file. Uses a hardware encoder
+    when one is available (see _pick_h264_encoder).
+    """
+    encoder = _pick_h264_encoder()
+    
+    cmd = [
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+        '-s', f'{width}x{height}', '-r', str(fps),
+        '-i', '-',
+        # yuv420p output needs even dimensions
+        '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+        '-c:v', encoder, *H264_ENCODER_ARGS[encoder],
+        '-pix_fmt', 'yuv420p',
+        str(filepath)
+    ]
+    return subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+
+def create_video_from_frames(
+    frames: List[np.ndarray],
+    output_path: str,
+    filename: str,
+    fps: Optional[float] = None,
+    verbose: bool = True
+) -> None:
+    """
+    Create MP4 video from list of frames.
+    
+    Args:
+        frames: List of RGB frames, uint8 or floats in [0, 1]
+        output_path: Directory to save video (created if needed)
+        filename: Output filename
+        fps: Frames per second (calculated for 6s duration if None)
+        verbose: Whether to print progress
+    """
+    if not frames:
+        print("No frames to create video")
+        return
+    
+    # Calculate FPS for 6-second duration
+    if fps is None:
+        fps = len(frames) / 6.0
+    
+    # Create output directory
+    Path(output_path).mkdir(parents=True, exist_ok=True)
+    
+    h, w = frames[0].shape[:2]
+    filepath = str(Path(output_path) / filename)
+    
+    # Pipe raw frames to ffmpeg for encoding
+    proc = open_video_pipe(filepath, w, h, fps)
+    
+    # Convert and write through two reused buffers: the next frame is converted
+    # on a worker thread while the current one is written (the pipe write
+    # releases the GIL), so only two 8-bit frames are ever held in memory
+    scratch = [np.empty(frames[0].shape, dtype=np.float32) for _ in range(2)]
+    buffers = [np.empty(frames[0].shape, dtype=np.uint8) for _ in range(2)]
+    
+    def convert(i):
+        # Convert to 8-bit unless the frame was already quantized; ffmpeg
+        # takes RGB directly, so no channel swap is needed
+        if frames[i].dtype == np.uint8:
+            return np.ascontiguousarray(frames[i])
+        return frame_to_uint8(frames[i], out=buffers[i % 2], scratch=scratch[i % 2])
+    
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        # Convert the first frame on this thread: numba's parallel runtime
+        # (used by frame_to_uint8) must first be started from the main
+        # thread, or the interpreter can hang at exit
+        frame_8bit = convert(0)
+        for i in range(len(frames)):
+            if verbose:
+                print(f"Processing frame {i+1}/{len(frames)} for video")
+            if i + 1 < len(frames):
+                future = pool.submit(convert, i + 1)
+            # Write from the array's own buffer; tobytes() would copy it first
+            proc.stdin.write(frame_8bit)
+            if i + 1 < len(frames):
+                frame_8bit = future.result()
+    
+    proc.stdin.close()
+    if proc.wait() != 0:
+        raise RuntimeError(f"ffmpeg failed to encode {filepath}")
+    
+    if verbose:
+        print(f"✓ Video saved: {filepath}")
+        print(f"✓ Duration: {len(frames)/fps:.1f} seconds")
+        print(f"✓ FPS: {fps:.1f}")
+        print(f"✓ Total frames: {len(frames)}")
+
+
+def write_gif_from_frames(
+    frames: List[np.ndarray],
+    filepath: str,
+    *,
+    fps: float,
+    scale: int = 512,
+    verbose: bool = True
+) -> None:
+    """
+    Encode in-memory RGB frames straight to a GIF through an ffmpeg pipe.
+    
+    Skips the MP4 encode/decode round trip of converting a finished video.
+    The palette is generated in the same pass (split into palettegen and
+    paletteuse), with the same filter settings as convert_mp4_to_gif.py.
+    
+    Args:
+        frames: List of RGB frames, uint8 or floats in [0, 1]
+        filepath: Output GIF path
+        fps: Frames per second
+        scale: Width to scale GIF to (height auto-calculated, default 512)
+        verbose: Whether to print progress
+    """
+    h, w = frames[0].shape[:2]
+    cmd = [
+        'ffmpeg', '-y', '-loglevel', 'error', '-threads', '0',
+        '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+        '-s', f'{w}x{h}', '-r', str(fps),
+        '-i', '-',
+        '-filter_complex',
+        f'scale={scale}:-1:flags=lanczos,split[a][b];'
+        f'[a]palettegen=stats_mode=diff[p];'
+        f'[b][p]paletteuse=dither=bayer:bayer_scale=5:diff_mode=rectangle',
+        str(filepath)
+    ]
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+    
+    frame_8bit = np.empty(frames[0].shape, dtype=np.uint8)
+    for frame in frames:
+        if frame.dtype != np.uint8:
+            frame = frame_to_uint8(frame, out=frame_8bit)
+        # Write from the array's own buffer; tobytes() would copy it first
+        proc.stdin.write(np.ascontiguousarray(frame))
+    
+    proc.stdin.close()
+    if proc.wait() != 0:
+        raise RuntimeError(f"ffmpeg failed to encode {filepath}")
+    
+    if verbose:
+        print(f"✓ GIF saved: {filepath}")
+
 if __name__ == "__main__":
     # Example usage
     from datetime import datetime
@@ -14,19 +14,18 @@ Total video duration: 6 seconds
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
 from datetime import datetime
 from pathlib import Path
-import cv2
-import tempfile
-import os
-from goes_climate_viz import download_and_average_goes_images
+from goes_climate_viz import sum_goes_images, save_as_png, frame_to_uint8, create_video_from_frames
 
 
 def create_progressive_frames(all_dates, hours, satellite, domain, coarsening_factor, cache_dir, verbose=True):
     """
     Create progressive averaging frames with exponential progression.
-    Reuses download_and_average_goes_images for each subset of dates.
+    
+    Keeps a running sum over the dates: each frame only sums the dates added
+    since the previous frame, so every image is loaded once rather than once
+    per later frame.
     
     Args:
         all_dates: List of datetime objects for all dates
@@ -55,31 +54,51 @@ def create_progressive_frames(all_dates, hours, satellite, domain, coarsening_fa
     
     print(f"Frame progression: {frame_counts}")
     
+    frames_dir = Path("progressive_video_output/Frames")
+    frames_dir.mkdir(parents=True, exist_ok=True)
+    
+    running_sum = None
+    running_count = 0
+    averaged_image = None  # Reused for every frame's average
+    previous_count = 0
+    
     # Generate each frame by averaging the first N dates
     for i, count in enumerate(frame_counts):
         if verbose:
             print(f"\nCreating frame {i+1}/{len(frame_counts)}: Average of first {count} images")
         
-        # Use the existing function to average the first 'count' dates
         try:
-            averaged_image = download_and_average_goes_images(
+            # Only the dates added since the previous frame need summing
+            new_sum, new_count = sum_goes_images(
                 hours=hours,
-                dates=all_dates[:count],  # First 'count' dates
+                dates=all_dates[previous_count:count],
                 satellite=satellite,
                 coarsening_factor=coarsening_factor,
                 domain=domain,
-                output_path="progressive_video_output/Frames",
-                save_format="png",
                 use_cache=True,
                 cache_dir=cache_dir,
                 verbose=False  # Suppress detailed output
             )
-            # Rename frame output file
-            frame_output = Path("progressive_video_output/Frames") / "goes_east_climate_avg.png"
-            frame_final = Path("progressive_video_output/Frames") / f"progressive_frame_{i+1:02d}_n_images={count}.png"
-            frame_output.rename(frame_final)
-        
-            frames.append(averaged_image)
+            previous_count = count
+            
+            if new_count:
+                if running_sum is None:
+                    running_sum = new_sum
+                else:
+                    running_sum += new_sum
+                running_count += new_count
+            
+            if running_count == 0:
+                raise RuntimeError("No images were successfully downloaded")
+            
+            if averaged_image is None:
+                averaged_image = np.empty_like(running_sum)
+            np.multiply(running_sum, 1.0 / running_count, out=averaged_image)
+            
+            # Quantize once here; 8-bit is all the video and the PNG need
+            frame = frame_to_uint8(averaged_image)
+            save_as_png(frame, frames_dir, f"progressive_frame_{i+1:02d}_n_images={count}.png")
+            frames.append(frame)
             
         except Exception as e:
             print(f"Error creating frame {i+1}: {e}")
@@ -89,62 +108,6 @@ def create_progressive_frames(all_dates, hours, satellite, domain, coarsening_fa
     return frames
 
 
-def create_video_from_frames(frames, output_path, filename, fps=None, verbose=True):
-    """
-    Create MP4 video from list of frames.
-    
-    Args:
-        frames: List of RGB image arrays
-        output_path: Directory to save video
-        filename: Output filename
-        fps: Frames per second (calculated for 10s duration if None)
-        verbose: Whether to print progress
-    """
-    if not frames:
-        print("No frames to create video")
-        return
-    
-    # Calculate FPS for 6-second duration
-    if fps is None:
-        fps = len(frames) / 6.0
-    
-    # Create output directory
-    Path(output_path).mkdir(parents=True, exist_ok=True)
-    
-    # Convert frames to video format
-    video_frames = []
-    for i, frame in enumerate(frames):
-        if verbose:
-            print(f"Processing frame {i+1}/{len(frames)} for video")
-        
-        # Convert to 8-bit RGB
-        frame_8bit = (frame * 255).astype(np.uint8)
-        
-        # Convert RGB to BGR for OpenCV
-        frame_bgr = cv2.cvtColor(frame_8bit, cv2.COLOR_RGB2BGR)
-        video_frames.append(frame_bgr)
-    
-    # Write video
-    if video_frames:
-        h, w = video_frames[0].shape[:2]
-        filepath = str(Path(output_path) / filename)
-        
-        # Create video writer
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(filepath, fourcc, fps, (w, h), isColor=True)
-        
-        for frame in video_frames:
-            out.write(frame)
-        
-        out.release()
-        
-        if verbose:
-            print(f"✓ Video saved: {filepath}")
-            print(f"✓ Duration: {len(frames)/fps:.1f} seconds")
-            print(f"✓ FPS: {fps:.1f}")
-            print(f"✓ Total frames: {len(frames)}")
-
-
 def main():
     """Generate progressive averaging video."""
     